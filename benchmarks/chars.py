@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+Benchmark for the `Char` instances that are created while rendering: the
+number of `Char` allocations per 1MB of output with colors, and the time.
+
+Usage:
+    python benchmarks/chars.py [<megabytes>]
+
+The output is fed in chunks of 4096 characters, like `Process` does. After
+every chunk, the lines of the screen that changed are read, like
+`PaneWindow` does during a render.
+
+"no cache" creates a `Char` for every cell that is read. "cache" is the
+`CharCache` in `pymux.storage`: a dictionary that is emptied when it has
+20,000 entries.
+"""
+from __future__ import unicode_literals, print_function
+from prompt_toolkit.layout.screen import Char
+
+from pymux.screen import BetterScreen
+from pymux.stream import BetterStream
+import pymux.storage as storage
+
+import random
+import six
+import sys
+import time
+
+WIDTH = 120
+HEIGHT = 50
+CHUNK_SIZE = 4096
+
+
+def create_log(size, r):
+    " Compiler output, with a few colors. "
+    words = ['gcc', '-O2', '-Wall', 'src/main.c', 'warning:', 'unused', 'variable',
+             '[INFO]', 'Building', 'module', 'done', 'in', '0.42s', 'ok']
+    colors = ['\x1b[1;33m', '\x1b[0m', '\x1b[38;5;208m', '\x1b[32m', '\x1b[1;31m']
+    result = []
+    length = 0
+
+    while length < size:
+        line = ' '.join((r.choice(colors) if r.random() < .2 else '') + r.choice(words)
+                        for _ in range(r.randint(3, 15)))
+        result.append(line + '\x1b[0m\r\n')
+        length += len(result[-1])
+
+    return ''.join(result)
+
+
+def create_ls(size, r):
+    " Like 'ls --color': file names in columns, colored by type. "
+    colors = ['\x1b[0m', '\x1b[01;34m', '\x1b[01;32m', '\x1b[01;36m', '\x1b[01;35m']
+    names = ['%s%i.%s' % (r.choice(['main', 'test_', 'lib', 'README', 'image_']), i,
+                          r.choice(['py', 'c', 'txt', 'png', 'so'])) for i in range(2000)]
+    result = []
+    length = 0
+
+    while length < size:
+        line = ''.join('%s%-20s\x1b[0m' % (r.choice(colors), r.choice(names)) for _ in range(5))
+        result.append(line + '\r\n')
+        length += len(result[-1])
+
+    return ''.join(result)
+
+
+def create_256_colors(size, r):
+    " Every word in another color of the 256 color palette. "
+    chars = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+    result = []
+    length = 0
+
+    while length < size:
+        line = ' '.join('\x1b[38;5;%im%s' % (r.randint(16, 255), ''.join(
+            r.choice(chars) for _ in range(r.randint(2, 9)))) for _ in range(12))
+        result.append(line + '\x1b[0m\r\n')
+        length += len(result[-1])
+
+    return ''.join(result)
+
+
+def create_cjk(size, r):
+    " Chinese text in a few colors: more (character, style) pairs than fit in the cache. "
+    chars = [six.unichr(c) for c in range(0x4e00, 0x4e00 + 4000)]
+    colors = ['\x1b[0m', '\x1b[31m', '\x1b[32m', '\x1b[33m', '\x1b[34m', '\x1b[1;35m', '\x1b[36m']
+    result = []
+    length = 0
+
+    while length < size:
+        line = ''.join(r.choice(colors) + ''.join(r.choice(chars) for _ in range(r.randint(2, 10)))
+                       for _ in range(6))
+        result.append(line[:WIDTH // 2] + '\x1b[0m\r\n')
+        length += len(result[-1].encode('utf-8'))
+
+    return ''.join(result)
+
+
+class _NoCache(object):
+    def __init__(self, create_char):
+        self.get = create_char
+
+
+def run(cache_class, data):
+    """
+    Feed the data to a screen, and read the changed lines after every chunk.
+    Return the number of `Char` instances created and the time.
+    """
+    counter = [0]
+
+    def create_char(key):
+        counter[0] += 1
+        return Char(key[0], storage.get_token(key[1]))
+
+    storage._char_cache = cache_class(create_char)
+
+    screen = BetterScreen(HEIGHT, WIDTH, lambda data: None)
+    stream = BetterStream(screen)
+    generation = None
+    start = time.time()
+
+    for i in range(0, len(data), CHUNK_SIZE):
+        stream.feed(data[i:i + CHUNK_SIZE])
+
+        generation, changed_lines = screen.damage.get_changes(generation)
+        data_buffer = screen.data_buffer
+
+        for y in range(screen.line_offset, screen.line_offset + HEIGHT):
+            if changed_lines is None or y in changed_lines:
+                row = data_buffer[y]
+                for x in range(WIDTH):
+                    row[x]
+
+    return counter[0], time.time() - start
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    size = int(megabytes * 1024 * 1024)
+    original_cache = storage._char_cache
+
+    print('Char instances created per 1MB of output:')
+
+    for name, create in [('log', create_log), ('ls', create_ls), ('256 colors', create_256_colors),
+                         ('cjk', create_cjk)]:
+        data = create(size, random.Random(0))
+
+        for cache_name, cache_class in [('no cache', _NoCache),
+                                        ('cache', storage.CharCache)]:
+            count, duration = run(cache_class, data)
+            print('%-12s %-9s %10i Char instances, %7.1f ms' % (
+                name + ':', cache_name, count / megabytes, duration * 1000 / megabytes))
+
+    storage._char_cache = original_cache
+
+
+if __name__ == '__main__':
+    main()
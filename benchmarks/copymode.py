@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""
+Benchmark for copy mode, with a long history: the time to enter copy mode and
+display the first frame, and the time per frame while moving the cursor up,
+with a search string highlighted.
+
+Usage:
+    python benchmarks/copymode.py [<lines>]
+
+"token list" is the implementation that was used before: a `BufferControl`
+that displays a (Token, text) list of the whole history, created when
+entering copy mode. "lazy" is the `ScrollBufferControl`, that only creates
+the visible rows, from the history of the screen. It also checks that both
+produce the same output.
+
+For both, entering copy mode still creates the text of the whole history (see
+`Process.create_copy_document`), so that time grows with the history.
+"""
+from __future__ import unicode_literals, print_function
+from prompt_toolkit.buffer import Buffer
+from prompt_toolkit.layout.containers import Window
+from prompt_toolkit.layout.controls import BufferControl
+from prompt_toolkit.layout.highlighters import SearchHighlighter, SelectionHighlighter
+from prompt_toolkit.layout.mouse_handlers import MouseHandlers
+from prompt_toolkit.layout.processors import Processor, Transformation
+from prompt_toolkit.layout.screen import Char, Screen, WritePosition
+from prompt_toolkit.search_state import SearchState
+from pygments.token import Token
+
+from pymux.arrangement import ScrollBuffer
+from pymux.layout import ScrollBufferControl
+from pymux.process import Process
+from pymux.screen import BetterScreen
+from pymux.stream import BetterStream
+
+import random
+import sys
+import time
+
+WIDTH = 120
+HEIGHT = 50
+
+
+def create_screen(count):
+    " Screen with `count` lines of history. "
+    r = random.Random(0)
+    words = ['gcc', '-O2', '-Wall', 'src/main.c', 'warning:', 'unused', 'variable',
+             '\x1b[32m[INFO]\x1b[0m', 'Building', 'module', 'done', 'in', '0.42s', 'ok']
+
+    screen = BetterScreen(HEIGHT, WIDTH, lambda data: None, get_history_limit=lambda: count)
+    BetterStream(screen).feed(''.join(
+        '%6i %s\r\n' % (i, ' '.join(r.choice(words) for _ in range(r.randint(3, 12))))
+        for i in range(count)))
+    return screen
+
+
+def create_token_list(screen):
+    " The (Token, text) list of the history, like it was created before. "
+    data_buffer = screen.data_buffer
+    token_list = []
+
+    for y in range(data_buffer.first_line, max(data_buffer.keys()) + 1):
+        row = data_buffer.get_line(y)
+        row_data = [row[x] for x in range(0, max(row.keys()) + 1 if row else 0)]
+
+        while (row_data and row_data[-1].char.isspace() and
+               (len(row_data[-1].token) < 3 or row_data[-1].token[2] is None)):
+            row_data.pop()
+
+        char_iter = iter(range(len(row_data)))
+        for x in char_iter:
+            c = row[x]
+            token_list.append((c.token, c.char))
+            if c.width == 2:
+                next(char_iter, None)
+
+        token_list.append((Token, '\n'))
+
+    while token_list and token_list[-1][1] == '\n':
+        token_list.pop()
+
+    return token_list
+
+
+class _Process(object):
+    " Stand-in for `Process`, for `create_copy_document`. "
+    def __init__(self, screen):
+        self.screen = screen
+
+
+class _Pane(object):
+    " Stand-in for `arrangement.Pane`. "
+    pane_id = 1
+    search_state = SearchState('warning: unused')
+
+
+class _UseTokenListProcessor(Processor):
+    def __init__(self, token_list):
+        self.token_list = token_list
+
+    def apply_transformation(self, cli, document, tokens):
+        return Transformation(document, self.token_list[:])
+
+    def invalidation_hash(self, cli, document):
+        return document.text
+
+
+class CLI(object):
+    " Stand-in for the `CommandLineInterface`. "
+    current_buffer_name = 'pane-1'
+    is_returning = False
+    is_ignoring_case = False
+
+    def __init__(self, buffer):
+        self.buffers = {'pane-1': buffer, 'search-1': Buffer()}
+
+
+def render(cli, window):
+    " Render the window, and return a comparable representation. "
+    screen = Screen()
+    window.write_to_screen(cli, screen, MouseHandlers(), WritePosition(0, 0, WIDTH, HEIGHT))
+
+    data_buffer = screen.data_buffer
+    return (screen.cursor_position,
+            [[(x, data_buffer[y][x].char, data_buffer[y][x].token) for x in sorted(data_buffer[y])]
+             for y in range(HEIGHT)])
+
+
+def run(name, screen, frames):
+    """
+    Enter copy mode, then move the cursor up and render for every frame.
+    Return the time to enter copy mode, the time per frame, and the output.
+    """
+    pane = _Pane()
+    start = time.time()
+
+    buffer = ScrollBuffer()
+    buffer.set_document(Process.create_copy_document(_Process(screen)), bypass_readonly=True)
+
+    if name == 'token list':
+        control = BufferControl(
+            buffer_name='pane-1', wrap_lines=False, default_char=Char(token=Token),
+            preview_search=True, get_search_state=lambda cli: pane.search_state,
+            search_buffer_name='search-1',
+            input_processors=[_UseTokenListProcessor(create_token_list(screen))],
+            highlighters=[
+                SearchHighlighter(search_buffer_name='search-1', preview_search=True,
+                                  get_search_state=lambda cli: pane.search_state),
+                SelectionHighlighter(),
+            ])
+    else:
+        buffer.data_buffer = screen.data_buffer
+        buffer.first_line = screen.data_buffer.first_line
+        control = ScrollBufferControl(pane)
+
+    cli = CLI(buffer)
+    window = Window(control)
+    output = [render(cli, window)]
+    enter_time = time.time() - start
+
+    start = time.time()
+    for _ in range(frames):
+        control.move_cursor_up(cli)
+        output.append(render(cli, window))
+
+    return enter_time, (time.time() - start) / frames, output
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print('%i lines of history, %ix%i window.' % (count, WIDTH, HEIGHT))
+
+    screen = create_screen(count)
+    results = []
+
+    for name, frames in [('token list', 10), ('lazy', 10)]:
+        enter_time, frame_time, output = run(name, screen, frames)
+        results.append(output)
+        print('%-12s enter copy mode: %8.1f ms, %8.2f ms per frame' % (
+            name + ':', enter_time * 1000, frame_time * 1000))
+
+    if results[0] == results[1]:
+        print('All frames are identical.')
+    else:
+        print('ERROR: The frames are different.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Microbenchmark for the dispatching of escape sequences: how many events per
+second are handled for escape heavy output, like the full screen redraws of
+vim or htop.
+
+Usage:
+    python benchmarks/dispatch.py [<frames>]
+
+The "getattr" engine shows how `BetterStream.dispatch` used to work: look up
+the handler for every event.
+"""
+from __future__ import unicode_literals, print_function
+from pymux.screen import BetterScreen
+from pymux.stream import BetterStream, TokenizingStream
+
+import random
+import sys
+import time
+
+LINES = 50
+COLUMNS = 160
+
+
+class GetattrStream(BetterStream):
+    " Dispatch without the handler table. "
+    def dispatch(self, event, *args, **kwargs):
+        try:
+            handler = getattr(self.listener, event)
+            handler(*args, **self.flags)
+        finally:
+            self.listener.__after__(self)
+
+            if kwargs.get('reset', True):
+                self.reset()
+
+
+class CountingStream(BetterStream):
+    " Count the events. "
+    count = 0
+
+    def dispatch(self, event, *args, **kwargs):
+        self.count += 1
+        super(CountingStream, self).dispatch(event, *args, **kwargs)
+
+
+def create_frames(count):
+    """
+    Create redraws like htop: for every line, position the cursor and write a
+    couple of short, colored fields.
+    """
+    r = random.Random(0)
+    frames = []
+
+    for i in range(count):
+        frame = ['\x1b[?25l\x1b[H']
+        for y in range(LINES):
+            frame.append('\x1b[%i;1H' % (y + 1))
+            for field in range(8):
+                frame.append('\x1b[%i;%im' % (r.choice([0, 1]), r.randint(30, 37)))
+                frame.append('%6.1f ' % (r.random() * 100))
+                frame.append('\x1b[38;5;%im%s' % (r.randint(0, 255), r.choice(['R', 'S', 'D'])))
+            frame.append('\x1b[0m\x1b[K')
+        frame.append('\x1b[%i;%iH\x1b[?25h' % (LINES, COLUMNS))
+        frames.append(''.join(frame))
+
+    return frames
+
+
+def run(frames, stream_class):
+    screen = BetterScreen(LINES, COLUMNS, lambda data: None)
+    stream = stream_class(screen)
+
+    start = time.time()
+    for frame in frames:
+        stream.feed(frame)
+    return stream, time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    frames = create_frames(count)
+
+    events = run(frames, CountingStream)[0].count
+    print('%i frames, %i events.' % (count, events))
+
+    for name, stream_class in [('getattr', GetattrStream),
+                               ('state-machine', BetterStream),
+                               ('tokenizer', TokenizingStream)]:
+        duration = run(frames, stream_class)[1]
+        print('%-15s %10.0f events/s' % (name + ':', events / duration))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Benchmark for the memory usage of the scrollback: resident memory and number
+of Python objects per 10,000 lines of history.
+
+Usage:
+    python benchmarks/memory.py [<lines>]
+
+"compact" is the storage in `pymux.storage`, "packed" is the same, but with
+the lines that are more than 1000 lines above the visible area packed and
+compressed. (The default of the "history-hot-lines" option.) "spill" keeps
+only 1000 lines of history in memory, and writes the older lines to a file
+(the "history-spill" option). "dict" shows the storage that was used before:
+a dictionary for every row, with a `Char` instance for every cell. Every
+measurement runs in a separate process.
+"""
+from __future__ import unicode_literals, print_function
+from prompt_toolkit.layout.screen import Char
+
+import gc
+import random
+import resource
+import subprocess
+import sys
+
+COLUMNS = 120
+
+
+def create_lines(count):
+    " Create log lines of 60-120 characters, with some colors. "
+    r = random.Random(0)
+    words = ['gcc', '-O2', '-Wall', 'src/main.c', 'warning:', 'unused', 'variable',
+             '[INFO]', 'Building', 'module', 'done', 'in', '0.42s', 'ok']
+    colors = ['\x1b[1;33m', '\x1b[0m', '\x1b[38;5;208m', '\x1b[32m']
+    lines = []
+
+    for i in range(count):
+        line = '%6i ' % i
+        while len(line) < r.randint(60, COLUMNS):
+            if r.random() < .1:
+                line += r.choice(colors)
+            line += r.choice(words) + ' '
+        lines.append(line[:COLUMNS] + '\x1b[0m\r\n')
+
+    return ''.join(lines)
+
+
+def get_rss():
+    " Maximum resident memory of this process, in bytes. "
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def measure(storage, count):
+    """
+    Fill the scrollback of a screen. Return the growth of the resident memory
+    and the number of objects.
+    """
+    from pymux.screen import BetterScreen
+    from pymux.stream import BetterStream
+
+    data = create_lines(count)
+    gc.collect()
+    rss = get_rss()
+    objects = len(gc.get_objects())
+
+    hot_lines = 1000 if storage in ('packed', 'spill') else count
+    history_limit = 1000 if storage == 'spill' else count
+    screen = BetterScreen(50, COLUMNS, lambda data: None,
+                          get_history_limit=lambda: history_limit,
+                          get_history_hot_lines=lambda: hot_lines,
+                          history_spill=storage == 'spill')
+    BetterStream(screen).feed(data)
+
+    if storage == 'dict':
+        # Convert row by row, so that both don't take memory at the same time.
+        data_buffer = screen.data_buffer
+        content = {}
+        for y in list(data_buffer):
+            row = data_buffer[y]
+            content[y] = dict((x, Char(row[x].char, row[x].token)) for x in row)
+            data_buffer.remove_lines_before(y + 1)
+        del screen, data_buffer, row
+    else:
+        content = screen
+
+    gc.collect()
+    result = get_rss() - rss, len(gc.get_objects()) - objects
+    del content
+    return result
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '--run':
+        rss, objects = measure(sys.argv[2], int(sys.argv[3]))
+        print(rss, objects)
+        return
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print('%i lines of scrollback, %i columns.' % (count, COLUMNS))
+
+    for storage in ('dict', 'compact', 'packed', 'spill'):
+        output = subprocess.check_output(
+            [sys.executable, __file__, '--run', storage, str(count)])
+        rss, objects = [int(i) for i in output.split()]
+        print('%-10s %8.1f MB %10i objects per 10k lines' % (
+            storage + ':', rss * 1e4 / count / 1024 / 1024, objects * 1e4 / count))
+
+
+if __name__ == '__main__':
+    main()
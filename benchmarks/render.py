@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+Benchmark for rendering a window with many panes, where only one pane
+changes between two renders (like typing in one of them).
+
+Usage:
+    python benchmarks/render.py [<frames>]
+
+This measures the time to write all the panes to the output screen, and
+compares the "full copy" (`Window._copy_body` of prompt_toolkit, which reads
+every cell of every pane) with the `PaneWindow`, which only reads the lines
+that were changed. It also checks that both produce the same output.
+"""
+from __future__ import unicode_literals, print_function
+from prompt_toolkit.layout.containers import Window
+from prompt_toolkit.layout.mouse_handlers import MouseHandlers
+from prompt_toolkit.layout.screen import Screen, WritePosition
+
+from pymux.layout import PaneWindow
+from pymux.screen import BetterScreen
+from pymux.stream import BetterStream
+
+import sys
+import time
+
+ROWS = 3
+COLUMNS = 4
+PANE_HEIGHT = 20
+PANE_WIDTH = 50
+
+
+class FullCopyPaneWindow(PaneWindow):
+    " Copy every cell, every time. "
+    _copy_body = Window._copy_body
+
+
+class Process(object):
+    " Stand-in for `pymux.process.Process`. "
+    def __init__(self):
+        self.screen = BetterScreen(PANE_HEIGHT, PANE_WIDTH, lambda data: None)
+        self.stream = BetterStream(self.screen)
+        self.stream.feed('$ ls -l\r\n' + 'drwxr-xr-x  2 user user  4096 src\r\n' * 30 + '$ ')
+
+    def set_size(self, width, height):
+        self.screen.resize(lines=height, columns=width)
+
+
+class Pane(object):
+    def __init__(self):
+        self.process = Process()
+
+
+class Arrangement(object):
+    def __init__(self, active_pane):
+        self.active_pane = active_pane
+
+    def get_active_pane(self, cli):
+        return self.active_pane
+
+
+class Pymux(object):
+    def __init__(self, active_pane):
+        self.arrangement = Arrangement(active_pane)
+
+
+class CLI(object):
+    current_buffer_name = 'DEFAULT_BUFFER'
+
+
+def render(windows):
+    " Write all the panes to a new output screen. "
+    screen = Screen()
+    mouse_handlers = MouseHandlers()
+
+    for i, window in enumerate(windows):
+        write_position = WritePosition(
+            xpos=(i % COLUMNS) * (PANE_WIDTH + 1), ypos=(i // COLUMNS) * (PANE_HEIGHT + 1),
+            width=PANE_WIDTH, height=PANE_HEIGHT)
+        window.write_to_screen(CLI(), screen, mouse_handlers, write_position)
+
+    return screen
+
+
+def run(window_class, frames):
+    """
+    Type in the first pane and render all panes after every key stroke.
+    Return the time per frame and the output screens.
+    """
+    panes = [Pane() for _ in range(ROWS * COLUMNS)]
+    pymux = Pymux(panes[0])
+    windows = [window_class(pymux, pane, pane.process) for pane in panes]
+    screens = [render(windows)]
+
+    # Mostly key strokes. Sometimes a scroll region, or the alternate screen.
+    data = []
+    for i in range(frames):
+        if i % 40 == 39:
+            data.append('x\r\n')
+        elif i % 100 == 99:
+            data.append('\x1b[?1049l' if i % 200 == 199 else '\x1b[?1049hvim')
+        elif i % 50 == 49:
+            data.append('\x1b[5;15r\x1b[15;1H\n\x1b[r\x1b[20;3H')
+        else:
+            data.append('x')
+
+    start = time.time()
+    for d in data:
+        panes[0].process.stream.feed(d)
+        screens.append(render(windows))
+    return (time.time() - start) / frames, screens
+
+
+def screen_content(screen):
+    " Comparable representation of the output screen. "
+    data_buffer = screen.data_buffer
+    return (screen.height, screen.cursor_position,
+            [[(x, data_buffer[y][x].char, data_buffer[y][x].token) for x in sorted(data_buffer[y])]
+             for y in range(screen.height)])
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print('%i panes of %ix%i, typing in one of them.' % (ROWS * COLUMNS, PANE_WIDTH, PANE_HEIGHT))
+
+    results = []
+    for name, window_class in [('full copy', FullCopyPaneWindow),
+                               ('damaged lines', PaneWindow)]:
+        duration, screens = run(window_class, frames)
+        results.append([screen_content(s) for s in screens])
+        print('%-15s %8.2f ms per frame' % (name + ':', duration * 1000))
+
+    if results[0] == results[1]:
+        print('All frames are identical.')
+    else:
+        print('ERROR: The frames are different.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
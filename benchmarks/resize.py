@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Benchmark for resizing a pane with a long history: the time per resize
+during a resize storm (the number of columns changes one by one, like when a
+terminal window is dragged), for different history sizes. This should not
+depend on the size of the history.
+
+The history itself is wrapped again once, when it's read (like when entering
+copy mode). That time is shown separately. It also checks that the text of
+the history is the same after wrapping it again.
+
+Usage:
+    python benchmarks/resize.py [<lines>]
+"""
+from __future__ import unicode_literals, print_function
+from pymux.screen import BetterScreen
+from pymux.stream import BetterStream
+
+import sys
+import time
+
+HEIGHT = 50
+
+
+def create_screen(count):
+    " Screen with `count` lines of output of different lengths. "
+    screen = BetterScreen(HEIGHT, 120, lambda data: None, get_history_limit=lambda: 10 * count)
+    BetterStream(screen).feed(''.join(
+        '%6i %s\r\n' % (i, '\x1b[32mword\x1b[0m ' * (i % 40)) for i in range(count)))
+    return screen
+
+
+def get_logical_lines(screen):
+    " The text of the history, with the soft wrapped lines joined. "
+    data_buffer = screen.data_buffer
+    result = []
+    line = []
+
+    for y in data_buffer:
+        row = data_buffer.get_line(y)
+        line.append(row.chars.tounicode())
+
+        if not row.wrapped:
+            result.append(''.join(line).rstrip())
+            line = []
+
+    # (The empty line with the cursor doesn't always exist.)
+    while result and not result[-1]:
+        result.pop()
+
+    return result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+    for lines in [count // 100, count // 10, count]:
+        screen = create_screen(lines)
+        text = get_logical_lines(screen)
+
+        start = time.time()
+        for columns in range(119, 59, -1):
+            screen.resize(columns=columns)
+        resize_time = (time.time() - start) / 60
+
+        start = time.time()
+        screen.reflow_history()
+        reflow_time = time.time() - start
+
+        print('%7i lines: %6.2f ms per resize, history: %8.1f ms, %7i rows after%s' % (
+            lines, resize_time * 1000, reflow_time * 1000, len(screen.data_buffer),
+            '' if get_logical_lines(screen) == text else ' ERROR: the text changed'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Benchmark for scrolling with a full history: the time per line of output,
+for different values of the "history-limit" option. This should not depend
+on the size of the history.
+
+It also measures scrolling inside a scroll region (like vim or less do), for
+different pane heights.
+
+Usage:
+    python benchmarks/scrollback.py [<lines>]
+
+The "full scan" engine shows how the history used to be stored: a dictionary
+that maps line numbers to rows. Old lines were removed by going through all
+the lines in the history, for every new line. And in a scroll region, every
+line was moved separately.
+"""
+from __future__ import unicode_literals, print_function
+from pymux.screen import BetterScreen
+from pymux.storage import Row
+from pymux.stream import BetterStream
+
+import sys
+import time
+
+
+class DictDataBuffer(dict):
+    def __missing__(self, y):
+        row = self[y] = Row()
+        return row
+
+
+class FullScanScreen(BetterScreen):
+    " Remove old lines by iterating over the whole history. "
+    def _reset_screen(self):
+        super(FullScanScreen, self)._reset_screen()
+        self.pt_screen.data_buffer = self.data_buffer = DictDataBuffer()
+
+    def _remove_old_lines_from_history(self):
+        remove_above = max(0, self.pt_screen.cursor_position.y - self.get_history_limit())
+        data_buffer = self.pt_screen.data_buffer
+        for line in list(data_buffer):
+            if line < remove_above:
+                del data_buffer[line]
+
+    def index(self):
+        top, bottom = self.margins
+
+        if (top, bottom) != (0, self.lines - 1) and \
+                self.pt_screen.cursor_position.y - self.line_offset == bottom:
+            for line in range(top, bottom):
+                self.data_buffer[line + self.line_offset] = \
+                    self.data_buffer[line + self.line_offset + 1]
+                del self.data_buffer[line + self.line_offset + 1]
+            self._remove_old_lines_from_history()
+        else:
+            super(FullScanScreen, self).index()
+
+
+def run(screen_class, history_limit, count):
+    """
+    Fill the history, then return the time per line for `count` more lines.
+    """
+    screen = screen_class(50, 120, lambda data: None,
+                          get_history_limit=lambda: history_limit)
+    stream = BetterStream(screen)
+
+    line = 'Building module in 0.42s ok\r\n'
+    stream.feed(line * (history_limit + 50))
+
+    data = line * count
+    start = time.time()
+    stream.feed(data)
+    return (time.time() - start) / count
+
+
+def run_region(screen_class, lines, count):
+    """
+    Scroll the region between the first and last line of the screen. Return
+    the time per line.
+    """
+    screen = screen_class(lines, 120, lambda data: None)
+    stream = BetterStream(screen)
+    stream.feed('Building module in 0.42s ok\r\n' * lines)
+    stream.feed('\x1b[2;%ir\x1b[%i;1H' % (lines - 1, lines - 1))
+
+    data = 'Building module in 0.42s ok\r\n' * count
+    start = time.time()
+    stream.feed(data)
+    return (time.time() - start) / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print('Time per line, with a full history.')
+
+    for history_limit in (1000, 10000, 50000):
+        result = ['history-limit %6i:' % history_limit]
+
+        for name, screen_class in [('full scan', FullScanScreen),
+                                   ('ring buffer', BetterScreen)]:
+            result.append('%s %8.1f us' % (name, run(screen_class, history_limit, count) * 1e6))
+        print('   '.join(result))
+
+    print('Time per line, in a scroll region.')
+
+    for lines in (50, 100, 200):
+        result = ['pane height %6i:  ' % lines]
+
+        for name, screen_class in [('full scan', FullScanScreen),
+                                   ('ring buffer', BetterScreen)]:
+            result.append('%s %8.1f us' % (name, run_region(screen_class, lines, count) * 1e6))
+        print('   '.join(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Benchmark for searching in copy mode: the time to find the next match, in a
+history of many lines.
+
+Usage:
+    python benchmarks/search.py [<lines>]
+
+"linear" is the search of prompt_toolkit, which goes through the text of the
+whole document. "index" is the `ScrollBuffer` of pymux, that uses the search
+index of the screen. It also checks that both find the same positions.
+"""
+from __future__ import unicode_literals, print_function
+from prompt_toolkit.buffer import Buffer
+from prompt_toolkit.enums import IncrementalSearchDirection
+from prompt_toolkit.search_state import SearchState
+
+from pymux.arrangement import ScrollBuffer
+from pymux.process import Process
+from pymux.screen import BetterScreen
+from pymux.stream import BetterStream
+
+import random
+import sys
+import time
+
+QUERIES = ['warning: unused', 'src/main.c', '4242 ', 'not there']
+
+
+def create_screen(count):
+    " Screen with `count` lines of history. "
+    r = random.Random(0)
+    words = ['gcc', '-O2', '-Wall', 'src/main.c', 'warning:', 'unused', 'variable',
+             '\x1b[32m[INFO]\x1b[0m', 'Building', 'module', 'done', 'in', '0.42s', 'ok']
+
+    screen = BetterScreen(50, 120, lambda data: None, get_history_limit=lambda: count)
+    BetterStream(screen).feed(''.join(
+        '%6i %s\r\n' % (i, ' '.join(r.choice(words) for _ in range(r.randint(3, 12))))
+        for i in range(count)))
+    return screen
+
+
+class _Process(object):
+    " Stand-in for `Process`, for `create_copy_document`. "
+    def __init__(self, screen):
+        self.screen = screen
+
+
+def run(buffer, document, count):
+    """
+    Search every query forward and backward, from a few positions. Return
+    the time per search and the results.
+    """
+    results = []
+    start = time.time()
+
+    for text in QUERIES:
+        for direction in (IncrementalSearchDirection.FORWARD, IncrementalSearchDirection.BACKWARD):
+            for position in range(0, len(document.text), len(document.text) // count):
+                buffer.cursor_position = position
+                results.append(buffer._search(SearchState(text, direction)))
+
+    return (time.time() - start) / len(results), results
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print('%i lines of history.' % count)
+
+    screen = create_screen(count)
+    document = Process.create_copy_document(_Process(screen))
+
+    linear = Buffer(read_only=True)
+    linear.set_document(document, bypass_readonly=True)
+
+    index = ScrollBuffer()
+    index.set_document(document, bypass_readonly=True)
+    index.search_index = screen.search_index
+    index.first_line = screen.data_buffer.first_line
+
+    results = []
+    for name, buffer in [('linear', linear), ('index', index)]:
+        duration, result = run(buffer, document, 10)
+        results.append(result)
+        print('%-10s %8.2f ms per search' % (name + ':', duration * 1000))
+
+    if results[0] == results[1]:
+        print('All results are identical.')
+    else:
+        print('ERROR: The results are different.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+Benchmark for the creation of panes: how many processes can be spawned per
+second, using a fork of the (big) pymux process, compared to `posix_spawn`.
+
+Usage:
+    python benchmarks/spawn.py [<count>] [<heap-megabytes>]
+
+The heap size simulates a pymux server with a lot of scrollback in memory.
+"""
+from __future__ import unicode_literals, print_function
+from prompt_toolkit.eventloop.posix import PosixEventLoop
+from pymux.process import Process, _HAS_POSIX_SPAWN
+
+import os
+import sys
+import time
+
+
+def spawn(count, use_fork):
+    eventloop = PosixEventLoop()
+    processes = []
+
+    # Passing a `before_exec_func` forces the fork code path.
+    before_exec_func = (lambda: None) if use_fork else None
+
+    start = time.time()
+    for i in range(count):
+        p = Process.from_command(eventloop, lambda: None, ['true'], lambda: None,
+                                 before_exec_func=before_exec_func)
+        p.start()
+        processes.append(p)
+    duration = time.time() - start
+
+    for p in processes:
+        os.waitpid(p.pid, 0)
+        os.close(p.master)
+
+    eventloop.close()
+    return count / duration
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    heap_mb = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    # Allocate a lot of small objects, like a server with a lot of history.
+    heap = [[i] for i in range(heap_mb * 1024 * 1024 // 100)]
+
+    print('Heap: ~%i MB, spawning %i processes.' % (heap_mb, count))
+    print('fork:        %8.1f panes/s' % spawn(count, use_fork=True))
+
+    if _HAS_POSIX_SPAWN:
+        print('posix_spawn: %8.1f panes/s' % spawn(count, use_fork=False))
+    else:
+        print('posix_spawn: not available on this platform.')
+
+    del heap
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Benchmark for parsing process output: how many megabytes of log output per
+second can be fed through the stream into the screen.
+
+Usage:
+    python benchmarks/stream.py [<megabytes>]
+
+This compares the character by character state machine from Pyte with the
+parser engines of pymux. (See the "vt-parser" option.) That all engines
+produce exactly the same screen is tested in tests/test_stream.py.
+"""
+from __future__ import unicode_literals, print_function
+from pyte.streams import Stream
+from pymux.screen import BetterScreen
+from pymux.stream import BetterStream, TokenizingStream
+
+import random
+import sys
+import time
+
+
+def create_log(size):
+    """
+    Create compiler/log like output, with some colors, cursor movements and
+    title changes.
+    """
+    r = random.Random(0)
+    words = ['gcc', '-O2', '-Wall', 'src/main.c', 'warning:', 'unused', 'variable',
+             '[INFO]', 'Building', 'module', 'done', 'in', '0.42s', 'ok', 'über',
+             '漢字', 'tab\there']
+    sequences = ['\x1b[1;33m', '\x1b[0m', '\x1b[38;5;208m', '\x1b[K', '\x1b[2A',
+                 '\x1b[?25l', '\x1b[?25h', '\x1b]0;make\x07', '\x1bM', '\x1b[12;40H',
+                 '\x1b[3;20r', '\x1b[r', '\x1b[2P', '\x1b[4@', '\x1b(0lqk\x1b(B',
+                 '\x1b[5n', '\x1b[?1h\x1b=', '\b\b', '\x1b[1;2;3A']
+    lines = []
+    total = 0
+
+    while total < size:
+        line = ' '.join(r.choice(words) for _ in range(r.randint(3, 14)))
+        if r.random() < .2:
+            line = r.choice(sequences) + line + r.choice(sequences)
+        line += '\r\n'
+        lines.append(line)
+        total += len(line)
+
+    return ''.join(lines)
+
+
+def feed(data, stream_class, feed_func):
+    """
+    Feed the data to a new screen. Return the duration.
+    """
+    screen = BetterScreen(50, 120, lambda data: None)
+    stream = stream_class(screen)
+    stream.attach(screen)
+
+    start = time.time()
+    for i in range(0, len(data), 4096):
+        feed_func(stream, data[i:i + 4096])
+    return time.time() - start
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    data = create_log(int(megabytes * 1024 * 1024))
+
+    print('Feeding %.1f MB of log output.' % megabytes)
+
+    engines = [
+        ('per character', BetterStream, Stream.feed),
+        ('state-machine', BetterStream, BetterStream.feed),
+        ('tokenizer', TokenizingStream, TokenizingStream.feed),
+    ]
+
+    for name, stream_class, feed_func in engines:
+        duration = feed(data, stream_class, feed_func)
+        print('%-15s %6.2f MB/s' % (name + ':', megabytes / duration))
+
+
+if __name__ == '__main__':
+    main()
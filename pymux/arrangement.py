@@ -12,11 +12,13 @@ from .process import Process
 
 from prompt_toolkit.buffer import Buffer
 from prompt_toolkit.document import Document
+from prompt_toolkit.enums import IncrementalSearchDirection
 from prompt_toolkit.interface import CommandLineInterface
 from prompt_toolkit.search_state import SearchState
 
-from pygments.token import Token
+from itertools import chain
 
+import bisect
 import math
 import os
 import weakref
@@ -25,6 +27,7 @@ import six
 __all__ = (
     'LayoutTypes',
     'Pane',
+    'ScrollBuffer',
     'HSplit',
     'VSplit',
     'Window',
@@ -44,6 +47,129 @@ class LayoutTypes:
     _ALL = [EVEN_HORIZONTAL, EVEN_VERTICAL, MAIN_HORIZONTAL, MAIN_VERTICAL, TILED]
 
 
+class ScrollBuffer(Buffer):
+    """
+    Read-only buffer for copy mode and for displaying text.
+
+    In copy mode, every line of the document is a line of the screen of the
+    process. The search then uses the :class:`pymux.search.SearchIndex` of
+    the screen to find the lines that contain the search string, instead of
+    going through the whole text. The colors are read from the `data_buffer`
+    of the screen, only for the lines that are displayed.
+    """
+    def __init__(self):
+        super(ScrollBuffer, self).__init__(read_only=True)
+
+        self.search_index = None
+        self.data_buffer = None  # `None` for text without colors.
+        self.first_line = 0  # Line number of the first line of the document.
+
+        # (text, lines, index of the start of every line) for the current text.
+        self._lines_cache = (None, [], [])
+
+    def get_lines(self):
+        """
+        Return the lines of the text, and the index of the start of every
+        line. (`Document` splits the whole text again for every new cursor
+        position.)
+        """
+        text = self.text
+
+        if self._lines_cache[0] is not text:
+            lines = text.split('\n')
+            starts = []
+            index = 0
+
+            for line in lines:
+                starts.append(index)
+                index += len(line) + 1
+
+            self._lines_cache = (text, lines, starts)
+
+        return self._lines_cache[1:]
+
+    def translate_index_to_position(self, index):
+        " Return the (row, col) tuple for this cursor position. "
+        lines, starts = self.get_lines()
+        row = max(0, bisect.bisect_right(starts, index) - 1)
+        return row, index - starts[row]
+
+    def translate_position_to_index(self, row, col):
+        """
+        Return the cursor position for this (row, col) tuple. (Both are
+        clipped to the text.)
+        """
+        lines, starts = self.get_lines()
+        row = max(0, min(row, len(lines) - 1))
+        return starts[row] + max(0, min(col, len(lines[row])))
+
+    def _search(self, search_state, include_current_position=False, count=1):
+        # (For very short strings, the linear search is faster.)
+        if self.search_index is None or not self.search_index.can_search(search_state.text):
+            return super(ScrollBuffer, self)._search(
+                search_state, include_current_position=include_current_position, count=count)
+
+        text = search_state.text
+        ignore_case = search_state.ignore_case()
+        lines, starts = self.get_lines()
+
+        if ignore_case:
+            text = text.lower()
+
+        def get_line(row):
+            return lines[row].lower() if ignore_case else lines[row]
+
+        def find_lines(start, end, reverse=False):
+            " Document rows between `start` and `end` that contain `text`. "
+            for a, b in self.search_index.get_candidate_ranges(
+                    text, self.first_line + start, self.first_line + end, reverse=reverse):
+                a = max(a - self.first_line, 0)
+                b = min(b - self.first_line, len(lines))
+
+                # Only look at the lines, when the text appears in the range.
+                if a < b:
+                    chunk = self.text[starts[a]:starts[b - 1] + len(lines[b - 1])]
+                    if text in (chunk.lower() if ignore_case else chunk):
+                        for row in (reversed(range(a, b)) if reverse else range(a, b)):
+                            if text in get_line(row):
+                                yield row
+
+        def search_once(row, col):
+            " Return the (row, col) tuple of the next match or `None`. "
+            if search_state.direction == IncrementalSearchDirection.FORWARD:
+                index = get_line(row).find(text, col if include_current_position else col + 1)
+                if index >= 0:
+                    return row, index
+
+                # Go forward, and wrap around.
+                for r in chain(find_lines(row + 1, len(lines)), find_lines(0, row + 1)):
+                    index = get_line(r).find(text)
+                    if index >= 0:
+                        return r, index
+            else:
+                index = get_line(row).rfind(text, 0, col)
+                if index >= 0:
+                    return row, index
+
+                # Go backward, and wrap around.
+                for r in chain(find_lines(0, row, reverse=True),
+                               find_lines(row, len(lines), reverse=True)):
+                    index = get_line(r).rfind(text)
+                    if index >= 0:
+                        return r, index
+
+        # Do 'count' search iterations.
+        position = self.translate_index_to_position(self.cursor_position)
+
+        for _ in range(count):
+            position = search_once(*position)
+            if position is None:
+                return  # Nothing found.
+
+        row, col = position
+        return self.working_index, starts[row] + col
+
+
 class Pane(object):
     """
     One pane, containing one process and a search buffer for going into copy
@@ -66,10 +192,7 @@ class Pane(object):
 
         # Prompt_toolkit buffer, for displaying scrollable text.
         # (In copy mode, or help mode.)
-        # Note: Because the scroll_buffer can only contain text, we also use the
-        #       copy_token_list, that contains a token list with color information.
-        self.scroll_buffer = Buffer(read_only=True)
-        self.copy_token_list = []
+        self.scroll_buffer = ScrollBuffer()
         self.display_scroll_buffer = False
         self.scroll_buffer_title = ''
 
@@ -83,24 +206,29 @@ class Pane(object):
         Suspend the process, and copy the screen content to the `scroll_buffer`.
         That way the user can search through the history and copy/paste.
         """
-        document, token_list = self.process.create_copy_document()
-        self._enter_scroll_buffer('Copy', document, token_list)
+        self._enter_scroll_buffer('Copy', self.process.create_copy_document())
+
+        # Search in the history using the index of the screen, and take the
+        # colors from the screen.
+        screen = self.process.screen
+        self.scroll_buffer.search_index = screen.search_index
+        self.scroll_buffer.data_buffer = screen.data_buffer
+        self.scroll_buffer.first_line = screen.data_buffer.first_line
 
     def display_text(self, text, title=''):
         """
         Display the given text in the scroll buffer.
         """
-        self._enter_scroll_buffer(
-            title,
-            document=Document(text, 0),
-            token_list=[(Token, text)])
+        self._enter_scroll_buffer(title, document=Document(text, 0))
 
-    def _enter_scroll_buffer(self, title, document, token_list):
+    def _enter_scroll_buffer(self, title, document):
         # Suspend child process.
         self.process.suspend()
 
         self.scroll_buffer.set_document(document, bypass_readonly=True)
-        self.copy_token_list = token_list
+        self.scroll_buffer.search_index = None
+        self.scroll_buffer.data_buffer = None
+        self.scroll_buffer.first_line = 0
         self.display_scroll_buffer = True
         self.scroll_buffer_title = title
 
@@ -7,6 +7,8 @@ from prompt_toolkit.terminal.vt100_output import _get_size, Vt100_Output
 
 from pymux.utils import nonblocking
 
+import errno
+import fcntl
 import getpass
 import glob
 import json
@@ -14,6 +16,7 @@ import os
 import signal
 import socket
 import sys
+import time
 
 
 __all__ = (
@@ -21,6 +24,12 @@ __all__ = (
     'list_clients',
 )
 
+# When the terminal is resized, the size is sent to the server after this
+# many seconds without another SIGWINCH, but at least every
+# `MAX_RESIZE_DELAY` seconds while resizing goes on.
+RESIZE_DELAY = .05
+MAX_RESIZE_DELAY = .2
+
 
 class Client(object):
     def __init__(self, socket_name):
@@ -32,6 +41,9 @@ class Client(object):
         self.socket.connect(socket_name)
         self.socket.setblocking(0)
 
+        self._size = None  # The last size that was sent to the server.
+        self._resize_times = None  # (first, last) SIGWINCH not yet handled.
+
     def run_command(self, command, pane_id=None):
         """
         Ask the server to run this command.
@@ -66,40 +78,72 @@ class Client(object):
             socket_fd = self.socket.fileno()
             current_timeout = INPUT_TIMEOUT  # Timeout, used to flush escape sequences.
 
-            with call_on_sigwinch(self._send_size):
-                while True:
-                    r, w, x = _select([stdin_fd, socket_fd], [], [], current_timeout)
-
-                    if socket_fd in r:
-                        # Received packet from server.
-                        data = self.socket.recv(1024)
-
-                        if data == b'':
-                            # End of file. Connection closed.
-                            # Reset terminal
-                            o = Vt100_Output.from_pty(sys.stdout)
-                            o.quit_alternate_screen()
-                            o.disable_mouse_support()
-                            o.reset_attributes()
-                            o.flush()
-                            return
-                        else:
-                            data_buffer += data
-
-                            while b'\0' in data_buffer:
-                                pos = data_buffer.index(b'\0')
-                                self._process(data_buffer[:pos])
-                                data_buffer = data_buffer[pos + 1:]
-
-                    elif stdin_fd in r:
-                        # Got user input.
-                        self._process_stdin()
-                        current_timeout = INPUT_TIMEOUT
-
-                    else:
-                        # Timeout. (Tell the server to flush the vt100 Escape.)
-                        self._send_packet({'cmd': 'flush-input'})
-                        current_timeout = None
+            # The SIGWINCH handler writes to this pipe, to wake up `select`.
+            # (In Python 3, `select` is resumed after a signal.)
+            winch_r, winch_w = os.pipe()
+            for fd in (winch_r, winch_w):
+                fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+            def received_winch():
+                try:
+                    os.write(winch_w, b'x')
+                except OSError as e:
+                    if e.errno != errno.EAGAIN:
+                        raise
+
+            try:
+                with call_on_sigwinch(received_winch):
+                    while True:
+                        timeout = current_timeout
+                        resize_timeout = self._get_resize_timeout()
+
+                        if resize_timeout is not None and (timeout is None or resize_timeout < timeout):
+                            timeout = resize_timeout
+
+                        r, w, x = _select([stdin_fd, socket_fd, winch_r], [], [], timeout)
+
+                        if winch_r in r:
+                            # Terminal resized. (Report the size when it stops.)
+                            os.read(winch_r, 1024)
+                            self._received_resize()
+
+                        if socket_fd in r:
+                            # Received packet from server.
+                            data = self.socket.recv(1024)
+
+                            if data == b'':
+                                # End of file. Connection closed.
+                                # Reset terminal
+                                o = Vt100_Output.from_pty(sys.stdout)
+                                o.quit_alternate_screen()
+                                o.disable_mouse_support()
+                                o.reset_attributes()
+                                o.flush()
+                                return
+                            else:
+                                data_buffer += data
+
+                                while b'\0' in data_buffer:
+                                    pos = data_buffer.index(b'\0')
+                                    self._process(data_buffer[:pos])
+                                    data_buffer = data_buffer[pos + 1:]
+
+                        elif stdin_fd in r:
+                            # Got user input.
+                            self._process_stdin()
+                            current_timeout = INPUT_TIMEOUT
+
+                        elif not r and timeout == current_timeout:
+                            # Timeout. (Tell the server to flush the vt100 Escape.)
+                            self._send_packet({'cmd': 'flush-input'})
+                            current_timeout = None
+
+                        if self._get_resize_timeout() == 0:
+                            self._resize_times = None
+                            self._send_size()
+            finally:
+                os.close(winch_r)
+                os.close(winch_w)
 
     def _process(self, data_buffer):
         """
@@ -152,13 +196,34 @@ class Client(object):
 
         self.socket.send(data + b'\0')
 
+    def _received_resize(self):
+        " SIGWINCH received. "
+        now = time.time()
+
+        if self._resize_times is None:
+            self._resize_times = (now, now)
+        else:
+            self._resize_times = (self._resize_times[0], now)
+
+    def _get_resize_timeout(self):
+        """
+        Return the time until the size has to be reported, or `None` when the
+        terminal was not resized.
+        """
+        if self._resize_times is not None:
+            first, last = self._resize_times
+            return max(0, min(last + RESIZE_DELAY, first + MAX_RESIZE_DELAY) - time.time())
+
     def _send_size(self):
-        " Report terminal size to server. "
+        " Report terminal size to server. (If it changed.) "
         rows, cols = _get_size(sys.stdout.fileno())
-        self._send_packet({
-            'cmd': 'size',
-            'data': [rows, cols]
-        })
+
+        if (rows, cols) != self._size:
+            self._size = (rows, cols)
+            self._send_packet({
+                'cmd': 'size',
+                'data': [rows, cols]
+            })
 
 
 def list_clients():
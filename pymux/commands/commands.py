@@ -7,7 +7,7 @@ import six
 import sys
 
 from prompt_toolkit.document import Document
-from prompt_toolkit.enums import SEARCH_BUFFER
+from prompt_toolkit.enums import SEARCH_BUFFER, IncrementalSearchDirection
 from prompt_toolkit.key_binding.vi_state import InputMode
 
 from pymux.arrangement import LayoutTypes
@@ -19,6 +19,7 @@ from pymux.key_mappings import pymux_key_to_prompt_toolkit_key_sequence, prompt_
 from pymux.layout import focus_right, focus_left, focus_up, focus_down
 from pymux.log import logger
 from pymux.options import SetOptionError
+from pymux.process import ExecError
 
 __all__ = (
     'call_command_handler',
@@ -279,6 +280,12 @@ def kill_window(pymux, cli, variables):
         pymux.kill_pane(pane)
 
 
+@cmd('kill-shell-pool')
+def kill_shell_pool(pymux, cli, variables):
+    " Kill the pre-started shells. (New ones will pick up the new environment.) "
+    pymux.shell_pool.clear()
+
+
 @cmd('suspend-client')
 def suspend_client(pymux, cli, variables):
     connection = pymux.get_connection_for_cli(cli)
@@ -325,7 +332,10 @@ def new_window(pymux, cli, variables):
     start_directory = variables['<start-directory>']
     name = variables['<name>']
 
-    pymux.create_window(cli, executable, start_directory=start_directory, name=name)
+    try:
+        pymux.create_window(cli, executable, start_directory=start_directory, name=name)
+    except ExecError as e:
+        raise CommandException(e.message)
 
 
 @cmd('next-window')
@@ -392,8 +402,11 @@ def split_window(pymux, cli, variables):
     start_directory = variables['<start-directory>']
 
     # The tmux definition of horizontal is the opposite of prompt_toolkit.
-    pymux.add_process(cli, executable, vsplit=variables['-h'],
-                      start_directory=start_directory)
+    try:
+        pymux.add_process(cli, executable, vsplit=variables['-h'],
+                          start_directory=start_directory)
+    except ExecError as e:
+        raise CommandException(e.message)
 
 
 @cmd('resize-pane', options="[(-L <left>)] [(-U <up>)] [(-D <down>)] [(-R <right>)] [-Z]")
@@ -536,6 +549,44 @@ def copy_mode(pymux, cli, variables):
     cli.buffers[SEARCH_BUFFER].reset()
 
 
+@cmd('find-window', options='<match-string>')
+def find_window(pymux, cli, variables):
+    """
+    Go to the next window that contains this text in its name, or in the
+    content of one of its panes (including the history). When the text is
+    found in the content, the pane goes into copy mode, with the cursor at
+    the last occurrence.
+    """
+    text = variables['<match-string>']
+    arrangement = pymux.arrangement
+
+    # Start at the window after the current one.
+    windows = arrangement.windows
+    index = windows.index(arrangement.get_active_window(cli))
+
+    for w in windows[index + 1:] + windows[:index + 1]:
+        if text in w.name:
+            arrangement.set_active_window(cli, w)
+            return
+
+        for pane in w.panes:
+            search_index = pane.process.screen.search_index
+
+            if any(search_index.find_lines(text, reverse=True)):
+                arrangement.set_active_window(cli, w)
+                w.active_pane = pane
+
+                pane.enter_copy_mode()
+                pane.search_state.text = text
+                pane.search_state.direction = IncrementalSearchDirection.BACKWARD
+                pane.scroll_buffer.apply_search(pane.search_state, include_current_position=True)
+
+                cli.buffers[SEARCH_BUFFER].reset()
+                return
+
+    raise CommandException('No windows matching: %s' % (text, ))
+
+
 @cmd('paste-buffer')
 def paste_buffer(pymux, cli, variables):
     """
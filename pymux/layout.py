@@ -12,17 +12,22 @@ from prompt_toolkit.layout.dimension import LayoutDimension as D
 from prompt_toolkit.layout.lexers import Lexer
 from prompt_toolkit.layout.lexers import SimpleLexer
 from prompt_toolkit.layout.menus import CompletionsMenu
-from prompt_toolkit.layout.processors import BeforeInput, AfterInput, AppendAutoSuggestion, Processor, Transformation
-from prompt_toolkit.layout.highlighters import SelectionHighlighter, SearchHighlighter
+from prompt_toolkit.layout.processors import BeforeInput, AfterInput, AppendAutoSuggestion
+from prompt_toolkit.layout.highlighters import SelectionHighlighter
 from prompt_toolkit.layout.prompt import DefaultPrompt
-from prompt_toolkit.layout.screen import Char, Screen
+from prompt_toolkit.layout.screen import Char, Screen, Point
 from prompt_toolkit.layout.toolbars import TokenListToolbar
 from prompt_toolkit.mouse_events import MouseEventTypes
+from prompt_toolkit.search_state import SearchState
+from prompt_toolkit.selection import SelectionType
 
 from pygments.token import Token
+from collections import defaultdict
 
 import pymux.arrangement as arrangement
+import bisect
 import datetime
+import re
 import six
 import weakref
 
@@ -31,6 +36,7 @@ from .filters import WaitsForConfirmation, WaitsForPrompt, InCommandMode
 from .format import format_pymux_string
 from .log import logger
 from .screen import DEFAULT_TOKEN
+from .storage import CharCache
 
 __all__ = (
     'LayoutManager',
@@ -271,6 +277,27 @@ class PaneControl(UIControl):
                         six.unichr(y + 33)))
 
 
+def _create_reverse_video_char(key):
+    char, token = key
+    attrs = list(token or DEFAULT_TOKEN)
+
+    # The token looks like ('C', *attrs). Replace the value of the reverse flag.
+    if attrs and attrs[0] == 'C':
+        attrs[-1] = not attrs[-1]  # Invert reverse value.
+        token = tuple(attrs)
+
+    return Char(char, token)
+
+
+# Maps (char, token) tuples to the `Char` with inverted reverse flag.
+_reverse_video_cache = CharCache(_create_reverse_video_char, size=10000)
+
+
+def _reverse_video(char):
+    " Return the `Char` for this character, in reverse video. "
+    return _reverse_video_cache.get((char.char, char.token))
+
+
 class PaneWindow(Window):
     """
     The window around a :class:`.PaneControl`.
@@ -283,6 +310,12 @@ class PaneWindow(Window):
             allow_scroll_beyond_bottom=True,
         )
 
+        # The visible lines, as copied during the previous render. Maps line
+        # numbers to {x: Char} dictionaries.
+        self._line_cache = {}
+        self._line_cache_key = None
+        self._damage_generation = None
+
     def write_to_screen(self, cli, screen, mouse_handlers, write_position):
         """
         Override, in order to implement reverse video efficiently.
@@ -297,13 +330,69 @@ class PaneWindow(Window):
                 row = data_buffer[y]
 
                 for x in range(write_position.xpos, write_position.xpos + write_position.width):
-                    char = row[x]
-                    token = list(char.token or DEFAULT_TOKEN)
+                    row[x] = _reverse_video(row[x])
+
+    def _copy_body(self, cli, temp_screen, highlighting, new_screen,
+                   write_position, move_x, width, applied_scroll_offsets):
+        """
+        Copy the visible part of the pane to the output screen.
+
+        This does the same as `Window._copy_body`, but the content of the
+        visible lines is kept between renders. Only the lines that were
+        changed by the process since then (see `BetterScreen.damage`) are read
+        again from the pane. The other lines are copied at once.
+        """
+        if highlighting:
+            # (Never set by the `PaneControl`.)
+            return super(PaneWindow, self)._copy_body(
+                cli, temp_screen, highlighting, new_screen, write_position,
+                move_x, width, applied_scroll_offsets)
+
+        xpos = write_position.xpos + move_x
+        ypos = write_position.ypos
+        height = write_position.height
+        vertical_scroll = self.vertical_scroll
+        horizontal_scroll = self.horizontal_scroll
+
+        self._damage_generation, changed_lines = \
+            self._process.screen.damage.get_changes(self._damage_generation)
+
+        # Reuse the previous content only when it was taken from the same
+        # screen (not the alternate screen), at the same position.
+        key = (temp_screen, xpos, width, horizontal_scroll)
+
+        if changed_lines is None or key != self._line_cache_key:
+            previous_lines = {}
+        else:
+            previous_lines = self._line_cache
+
+        temp_buffer = temp_screen.data_buffer
+        new_buffer = new_screen.data_buffer
+        line_cache = {}
+
+        for y in range(0, height):
+            line = y + vertical_scroll
+            cells = previous_lines.get(line)
+
+            if cells is None or line in changed_lines:
+                temp_row = temp_buffer[line]
+                cells = dict((x + xpos, temp_row[x + horizontal_scroll]) for x in range(0, width))
+
+            line_cache[line] = cells
+            new_buffer[y + ypos].update(cells)
 
-                    # The token looks like ('C', *attrs). Replace the value of the reverse flag.
-                    if token and token[0] == 'C':
-                        token[-1] = not token[-1]  # Invert reverse value.
-                        row[x] = Char(char.char, tuple(token))
+        self._line_cache = line_cache
+        self._line_cache_key = key
+
+        if self.content.has_focus(cli):
+            new_screen.cursor_position = Point(y=temp_screen.cursor_position.y + ypos - vertical_scroll,
+                                               x=temp_screen.cursor_position.x + xpos - horizontal_scroll)
+
+            if not self.always_hide_cursor(cli):
+                new_screen.show_cursor = temp_screen.show_cursor
+
+        # Update height of the output screen.
+        new_screen.height = max(new_screen.height, ypos + max(height, 1))
 
 
 class SearchWindow(Window):
@@ -727,20 +816,275 @@ def _create_split(pymux, split):
                       report_dimensions_callback=report_dimensions_callback)
 
 
-class _UseCopyTokenListProcessor(Processor):
+# Character widths, for the text of a `ScrollBuffer`. (Like `Char.width`.)
+_char_widths = {}
+
+
+def _get_text_width(text):
+    " Return the number of columns that this text takes in copy mode. "
+    result = 0
+
+    for c in text:
+        try:
+            result += _char_widths[c]
+        except KeyError:
+            width = _char_widths[c] = Char(c).width
+            result += width
+
+    return result
+
+
+# Characters of which the width can be different from one column.
+_non_ascii_re = re.compile('[^ -~\n]')
+
+
+class _LazyDict(dict):
+    " Dictionary that creates the missing items when they are read. "
+    def __init__(self, create_item):
+        self.create_item = create_item
+
+    def __missing__(self, key):
+        result = self[key] = self.create_item(key)
+        return result
+
+
+class ScrollBufferControl(BufferControl):
     """
-    In order to allow highlighting of the copy region, we use a preprocessed
-    list of (Token, text) tuples. This processor returns just that list for the
-    given pane.
+    `BufferControl` for the `ScrollBuffer` of a pane. (For copy mode, and for
+    displaying text.)
+
+    `BufferControl` writes the whole document to a screen, every time when
+    the text changes. For a long history, that is too slow. This control
+    returns a screen that only creates the rows that are read by the
+    `Window`: the visible rows. In copy mode, the colors are taken from the
+    history of the screen of the process. The search matches and the
+    selection are highlighted the same way as by the `SearchHighlighter` and
+    the `SelectionHighlighter`.
     """
+    # A double width character takes two cells. (See `Screen.write_data`.)
+    _wide_char_placeholder = Char(six.unichr(0))
+
     def __init__(self, arrangement_pane):
-        self.arrangement_pane = arrangement_pane
+        super(ScrollBufferControl, self).__init__(
+            buffer_name='pane-%i' % arrangement_pane.pane_id,
+            wrap_lines=False,
+            focus_on_click=True,
+            default_char=Char(token=Token),
+            preview_search=True,
+            get_search_state=lambda cli: arrangement_pane.search_state,
+            search_buffer_name='search-%i' % arrangement_pane.pane_id)
+
+        self._content_width = (None, 0)  # (text, width of the longest line)
+
+    def _get_content_width(self, buffer):
+        """
+        Number of columns of the longest line of the text, on the screen.
+        (Only calculated once for every text.)
+        """
+        text = buffer.text
+
+        if self._content_width[0] is not text:
+            lines, starts = buffer.get_lines()
+            rows = set(bisect.bisect_right(starts, m.start()) - 1
+                       for m in _non_ascii_re.finditer(text))
 
-    def apply_transformation(self, cli, document, tokens):
-        return Transformation(document, self.arrangement_pane.copy_token_list[:])
+            # Only the lines with other than printable ASCII characters can
+            # have another width than their length. (The cursor can be after
+            # the end of the text.)
+            width = max(
+                [len(line) for line in lines] +
+                [_get_text_width(lines[row]) for row in rows] +
+                [_get_text_width(lines[-1]) + 1])
 
-    def invalidation_hash(self, cli, document):
-        return document.text
+            self._content_width = (text, width)
+
+        return self._content_width[1]
+
+    def preferred_width(self, cli, max_available_width):
+        return self._get_content_width(self._buffer(cli))
+
+    def _get_search_text(self, cli):
+        " The text to be highlighted. (See `SearchHighlighter`.) "
+        search_text = cli.buffers[self.search_buffer_name].text
+
+        if self.preview_search(cli) and search_text:
+            return search_text
+        return self.get_search_state(cli).text
+
+    def create_screen(self, cli, width, height):
+        buffer = self._buffer(cli)
+
+        # Get the document to be shown. (The search document, when we are
+        # searching. See `BufferControl.create_screen`.)
+        if self.preview_search(cli) and cli.buffers[self.search_buffer_name].text:
+            ss = self.get_search_state(cli)
+            document = buffer.document_for_search(SearchState(
+                text=cli.current_buffer.text,
+                direction=ss.direction,
+                ignore_case=ss.ignore_case))
+        else:
+            document = buffer.document
+
+        lines, starts = buffer.get_lines()
+        text_length = len(buffer.text)
+        data_buffer = buffer.data_buffer
+        first_line = buffer.first_line
+        default_char = self.default_char
+        placeholder = self._wide_char_placeholder
+
+        def get_x(row, col):
+            " Screen column of this (row, col) position in the text. "
+            return _get_text_width(lines[row][:col])
+
+        def get_row_size(row):
+            # (The cursor can be after the end of the text.)
+            return max(1, _get_text_width(lines[row]) + (1 if row == len(lines) - 1 else 0))
+
+        def get_position(index):
+            return buffer.translate_index_to_position(min(index, text_length))
+
+        def get_chars(y):
+            " Yield the `Char` instances for this line of the text. "
+            line = lines[y]
+
+            if data_buffer is None:
+                for c in line:
+                    yield Char(c, Token)
+            else:
+                # Every cell of the row of the screen is one character in the
+                # text, or two in case of a control character. (Like '^A'.)
+                row = data_buffer.get_line(first_line + y)
+                column = index = 0
+
+                while index < len(line):
+                    cell = row[column]
+
+                    for c in cell.char:
+                        yield cell if len(cell.char) == 1 else Char(c, cell.token)
+
+                    index += len(cell.char)
+                    column += 2 if cell.width == 2 else 1
+
+        def create_row(y):
+            " Create the row of the screen for this line of the text. "
+            result = defaultdict(lambda: default_char)
+
+            if y < len(lines):
+                x = 0
+
+                for char in get_chars(y):
+                    result[x] = char
+
+                    if char.width > 1:
+                        result[x + 1] = placeholder
+                    x += char.width
+
+            return result
+
+        # Cursor position.
+        cursor_row, cursor_col = get_position(document.cursor_position)
+        cursor_x = get_x(cursor_row, cursor_col)
+
+        screen = Screen(default_char, initial_width=max(width, self._get_content_width(buffer)))
+        screen.data_buffer = _LazyDict(create_row)
+        screen.height = len(lines)
+        screen.cursor_position = Point(y=cursor_row, x=cursor_x)
+
+        def xy_to_cursor_position(x, y):
+            """ Turn x/y screen coordinates back to the original cursor
+            position in the buffer. """
+            if y >= len(lines):
+                y, x = len(lines) - 1, 0
+
+            index = starts[y]
+
+            for c in lines[y]:
+                width = _get_text_width(c)
+                if x < width:
+                    break
+                x -= width
+                index += 1
+
+            return index
+
+        self._xy_to_cursor_position = xy_to_cursor_position
+
+        # Search matches.
+        search_text = self._get_search_text(cli)
+
+        if search_text and not cli.is_returning:
+            search_re = re.compile(re.escape(search_text), re.IGNORECASE if cli.is_ignoring_case else 0)
+        else:
+            search_re = None
+
+        # Selection.
+        selection = document.selection
+
+        if selection:
+            from_, to = sorted([document.cursor_position, selection.original_cursor_position])
+            (from_row, from_col), (to_row, to_col) = get_position(from_), get_position(to)
+
+            if selection.type == SelectionType.BLOCK:
+                from_col, to_col = sorted([from_col, to_col])
+            else:
+                if selection.type == SelectionType.LINES:
+                    from_col = 0
+                    to = starts[to_row] + len(lines[to_row])
+
+                # (The end of the selection is included.)
+                to_row, to_col = get_position(to + 1)
+
+        def get_fragments(y):
+            " Yield (start_x, end_x, token) tuples for this row. "
+            line = lines[y]
+
+            if search_re:
+                for m in search_re.finditer(line):
+                    if starts[y] + m.start() <= document.cursor_position < starts[y] + m.end():
+                        token = Token.SearchMatch.Current
+                    else:
+                        token = Token.SearchMatch
+
+                    yield get_x(y, m.start()), get_x(y, m.end()), token
+
+            if selection and from_row <= y <= to_row:
+                token = Token.SelectedText
+
+                if selection.type == SelectionType.BLOCK:
+                    if from_col < len(line):
+                        yield get_x(y, from_col), get_x(y, min(len(line) - 1, to_col) + 1), token
+                elif from_row == to_row:
+                    yield get_x(y, from_col), get_x(y, to_col), token
+                elif y == from_row:
+                    yield get_x(y, from_col), get_row_size(y), token
+                elif y == to_row:
+                    yield 0, get_x(y, to_col), token
+                else:
+                    yield 0, get_row_size(y), token
+
+        def create_highlighting_row(y):
+            " Map the columns of this row to the token for the highlighting. "
+            result = defaultdict(lambda: None)
+
+            if y < len(lines):
+                # (The first fragment takes precedence.)
+                for start_x, end_x, token in reversed(list(get_fragments(y))):
+                    for x in range(start_x, end_x):
+                        result[x] = token
+
+            return result
+
+        return screen, _LazyDict(create_highlighting_row)
+
+    def move_cursor_down(self, cli):
+        b = self._buffer(cli)
+        row, col = b.translate_index_to_position(b.cursor_position)
+        b.cursor_position = b.translate_position_to_index(row + 1, col)
+
+    def move_cursor_up(self, cli):
+        b = self._buffer(cli)
+        row, col = b.translate_index_to_position(b.cursor_position)
+        b.cursor_position = b.translate_position_to_index(row - 1, col)
 
 
 def _create_container_for_process(pymux, arrangement_pane, zoom=False):
@@ -770,14 +1114,18 @@ def _create_container_for_process(pymux, arrangement_pane, zoom=False):
         if process.is_terminated:
             result.append((Token.Terminated, ' Terminated '))
 
+        # Input that the process didn't read yet. (E.g. a large paste.)
+        if process.input_queue_size:
+            result.append((Token.InputQueue, ' Sending %i bytes ' % process.input_queue_size))
+
         # Scroll buffer info.
         if arrangement_pane.display_scroll_buffer:
             result.append((token.CopyMode, ' %s ' % arrangement_pane.scroll_buffer_title))
 
             # Cursor position.
-            document = arrangement_pane.scroll_buffer.document
+            scroll_buffer = arrangement_pane.scroll_buffer
             result.append((token.CopyMode.Position, ' %i,%i ' % (
-                document.cursor_position_row, document.cursor_position_col)))
+                scroll_buffer.translate_index_to_position(scroll_buffer.cursor_position))))
 
         if arrangement_pane.name:
             result.append((name_token, ' %s ' % arrangement_pane.name))
@@ -833,23 +1181,7 @@ def _create_container_for_process(pymux, arrangement_pane, zoom=False):
 
                     # The copy/paste buffer.
                     ConditionalContainer(
-                        content=Window(BufferControl(
-                            buffer_name='pane-%i' % arrangement_pane.pane_id,
-                            wrap_lines=False,
-                            focus_on_click=True,
-                            default_char=Char(token=Token),
-                            preview_search=True,
-                            get_search_state=lambda cli: arrangement_pane.search_state,
-                            search_buffer_name='search-%i' % arrangement_pane.pane_id,
-                            input_processors=[_UseCopyTokenListProcessor(arrangement_pane)],
-                            highlighters=[
-                                SearchHighlighter(
-                                   search_buffer_name='search-%i' % arrangement_pane.pane_id,
-                                   get_search_state=lambda cli: arrangement_pane.search_state,
-                                   preview_search=True),
-                                SelectionHighlighter(),
-                            ],
-                        )),
+                        content=Window(ScrollBufferControl(arrangement_pane)),
                         filter=~clock_is_visible & Condition(lambda cli: arrangement_pane.display_scroll_buffer)
                     ),
                     # Search toolbar. (Displayed when this pane has the focus, and searching.)
@@ -23,12 +23,15 @@ from .key_bindings import KeyBindingsManager
 from .layout import LayoutManager, Justify
 from .log import logger
 from .options import ALL_OPTIONS
-from .process import Process
+from .process import Process, ChildReaper, ExecError
 from .rc import STARTUP_COMMANDS
 from .server import ServerConnection, bind_socket
+from .shell_pool import ShellPool
+from .stream import STREAM_CLASSES
 from .style import PymuxStyle
 from .utils import get_default_shell
 
+import datetime
 import os
 import signal
 import six
@@ -98,6 +101,9 @@ class Pymux(object):
         self.status_keys_vi_mode = False
         self.mode_keys_vi_mode = False
         self.history_limit = 2000
+        self.history_hot_lines = 1000
+        self.enable_history_spill = False
+        self.read_budget = 64 * 1024
         self.default_terminal = 'xterm-256color'
         self.status_left = '[#S] '
         self.status_left_length = 20
@@ -108,6 +114,8 @@ class Pymux(object):
         self.session_name = '0'
         self.status_justify = Justify.LEFT
         self.default_shell = get_default_shell()
+        self.shell_pool_size = 0
+        self.vt_parser = 'state-machine'
 
         self.options = ALL_OPTIONS
 
@@ -135,6 +143,14 @@ class Pymux(object):
         # Create eventloop.
         self.eventloop = PosixEventLoop()
 
+        # Reaper for the processes that run in the panes.
+        self.child_reaper = ChildReaper(self.eventloop)
+
+        # Shells that are started in advance. (See "shell-pool-size".)
+        self.shell_pool = ShellPool(
+            lambda key: self._spawn_pane([key[0]], key[1]))
+        self._shell_pool_refill_key = None  # Key of the scheduled refill.
+
         # Key bindings manager.
         self.key_bindings_manager = KeyBindingsManager(self)
 
@@ -207,63 +223,106 @@ class Pymux(object):
         assert command is None or isinstance(command, six.text_type)
         assert start_directory is None or isinstance(start_directory, six.text_type)
 
+        # Start directory.
+        if start_directory:
+            path = start_directory
+        elif window and window.active_process:
+            # When the path of the active process is known,
+            # start the new process at the same location.
+            path = window.active_process.get_cwd()
+        else:
+            path = None
+
+        path = path or self.original_cwd
+
+        if command:
+            return self._spawn_pane(command.split(), path)
+        elif not self.shell_pool_size:
+            return self._spawn_pane([self.default_shell], path)
+
+        # Adopt a shell from the pool, if one is available, and refill the
+        # pool once the UI has been painted.
+        key = (self.default_shell, path, self.default_terminal, self.vt_parser)
+        pane = self.shell_pool.take(key)
+
+        def refill():
+            # (For the latest key, when several panes were created.)
+            key = self._shell_pool_refill_key
+            self._shell_pool_refill_key = None
+            self.shell_pool.refill(key, self.shell_pool_size)
+
+        if self.shell_pool.needs_refill(key, self.shell_pool_size):
+            if self._shell_pool_refill_key is None:
+                self.eventloop.call_from_executor(
+                    refill, _max_postpone_until=datetime.datetime.now() + datetime.timedelta(seconds=1))
+            self._shell_pool_refill_key = key
+
+        if pane:
+            logger.info('Took process %r from the shell pool.', self.default_shell)
+            return pane
+        else:
+            return self._spawn_pane([self.default_shell], path)
+
+    def _spawn_pane(self, command, path):
+        """
+        Start a new process, and return the :class:`pymux.arrangement.Pane`
+        for it.
+
+        :param command: List of strings: the command and its arguments.
+        :param path: The working directory for the process.
+        """
         def done_callback():
             " When the process finishes. "
+            # A pooled shell that exited before being used.
+            if self.shell_pool.remove(pane):
+                return
+
             if not self.remain_on_exit:
                 # Remove pane from layout.
                 self.arrangement.remove_pane(pane)
+                pane.process.screen.close()
 
                 # No panes left? -> Quit.
                 if not self.arrangement.has_panes:
+                    self.shell_pool.clear()
                     self.eventloop.stop()
 
             self.invalidate()
 
+        def invalidate():
+            " Redraw, unless this is a pooled shell. (It's not visible.) "
+            if pane not in self.shell_pool:
+                self.invalidate()
+
         def bell():
             " Sound bell on all clients. "
             if self.enable_bell:
                 for c in self.clis.values():
                     c.output.bell()
 
-        # Start directory.
-        if start_directory:
-            path = start_directory
-        elif window and window.active_process:
-            # When the path of the active process is known,
-            # start the new process at the same location.
-            path = window.active_process.get_cwd()
-        else:
-            path = None
-
-        def before_exec():
-            " Called in the process fork (in the child process). "
-            # Go to this directory.
-            try:
-                os.chdir(path or self.original_cwd)
-            except OSError:
-                pass  # No such file or directory.
-
-            # Set terminal variable. (We emulate xterm.)
-            os.environ['TERM'] = self.default_terminal
-
-            # Make sure to set the PYMUX environment variable.
-            if self.socket_name:
-                os.environ['PYMUX'] = '%s,%i' % (
-                    self.socket_name, pane.pane_id)
-
-        if command:
-            command = command.split()
-        else:
-            command = [self.default_shell]
+        # Environment. (We emulate xterm.)
+        env = dict(os.environ)
+        env['TERM'] = self.default_terminal
 
         # Create process and pane.
         process = Process.from_command(
-            self.eventloop, self.invalidate, command, done_callback,
+            self.eventloop, invalidate, command, done_callback,
             bell_func=bell,
-            before_exec_func=before_exec)
+            child_reaper=self.child_reaper,
+            cwd=path,
+            env=env,
+            stream_class=STREAM_CLASSES[self.vt_parser],
+            get_history_limit=lambda: self.history_limit,
+            get_history_hot_lines=lambda: self.history_hot_lines,
+            history_spill=self.enable_history_spill,
+            read_budget=max(1, self.read_budget))
 
         pane = Pane(process)
 
+        # Make sure to set the PYMUX environment variable.
+        if self.socket_name:
+            env['PYMUX'] = '%s,%i' % (self.socket_name, pane.pane_id)
+
         # Keep track of panes. This is a WeakKeyDictionary, we only add, but
         # don't remove.
         self.panes_by_id[pane.pane_id] = pane
@@ -319,9 +378,11 @@ class Pymux(object):
 
         # Remove from layout.
         self.arrangement.remove_pane(pane)
+        pane.process.screen.close()
 
         # No panes left? -> Quit.
         if not self.arrangement.has_panes:
+            self.shell_pool.clear()
             self.eventloop.stop()
 
     def leave_command_mode(self, cli, append_to_history=False):
@@ -413,8 +474,15 @@ class Pymux(object):
             if self.source_file:
                 call_command_handler('source-file', self, cli, [self.source_file])
 
-            # Make sure that there is one window created.
-            self.create_window(cli, command=self.startup_command)
+            # Make sure that there is one window created. (When the startup
+            # command or the default-shell can't be executed, start the login
+            # shell of the user instead, and show the error.)
+            try:
+                self.create_window(cli, command=self.startup_command)
+            except ExecError as e:
+                pane = self._spawn_pane([get_default_shell()], self.original_cwd)
+                self.arrangement.create_window(cli, pane)
+                self.show_message(cli, e.message)
 
         return cli
 
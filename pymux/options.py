@@ -8,6 +8,7 @@ import six
 from .key_mappings import PYMUX_TO_PROMPT_TOOLKIT_KEYS, pymux_key_to_prompt_toolkit_key_sequence
 from .utils import get_default_shell
 from .layout import Justify
+from .stream import STREAM_CLASSES
 
 __all__ = (
     'Option',
@@ -162,26 +163,67 @@ class JustifyOption(Option):
             raise SetOptionError('Invalid justify option.')
 
 
+class VtParserOption(Option):
+    " Parser engine for the output of processes in new panes. "
+    def __init__(self, attribute_name):
+        self.attribute_name = attribute_name
+
+    def get_all_values(self, pymux):
+        return sorted(STREAM_CLASSES)
+
+    def set_value(self, pymux, value):
+        if value in STREAM_CLASSES:
+            setattr(pymux, self.attribute_name, value)
+        else:
+            raise SetOptionError('Invalid parser: expecting one of %s.' %
+                                 ', '.join(sorted(STREAM_CLASSES)))
+
+
+class ShellPoolOption(Option):
+    """
+    Wraps an option that changes how new shells are started. When it's set,
+    the shells in the pool are outdated (or the pool is disabled), so they
+    are killed. (They are started again for the next new pane.)
+    """
+    def __init__(self, option):
+        assert isinstance(option, Option)
+        self.option = option
+
+    def get_all_values(self, pymux):
+        return self.option.get_all_values(pymux)
+
+    def set_value(self, pymux, value):
+        self.option.set_value(pymux, value)
+        pymux.shell_pool.clear()
+
+
 ALL_OPTIONS = {
     'base-index': BaseIndexOption(),
     'bell': OnOffOption('enable_bell'),
     'history-limit': PositiveIntOption(
         'history_limit', [200, 500, 1000, 2000, 5000, 10000]),
+    'history-hot-lines': PositiveIntOption(
+        'history_hot_lines', [0, 100, 1000, 5000]),
+    'history-spill': OnOffOption('enable_history_spill'),
     'mouse': OnOffOption('enable_mouse_support'),
     'prefix': KeyPrefixOption(),
+    'read-budget': PositiveIntOption(
+        'read_budget', [4096, 16384, 65536, 262144]),
     'remain-on-exit': OnOffOption('remain_on_exit'),
     'status': OnOffOption('enable_status'),
     'status-keys': KeysOption('status_keys_vi_mode'),
     'mode-keys': KeysOption('mode_keys_vi_mode'),
-    'default-terminal': StringOption(
-        'default_terminal', ['xterm', 'xterm-256color', 'screen']),
+    'default-terminal': ShellPoolOption(StringOption(
+        'default_terminal', ['xterm', 'xterm-256color', 'screen'])),
     'status-right': StringOption('status_right'),
     'status-left': StringOption('status_left'),
     'status-right-length': PositiveIntOption('status_right_length', [20]),
     'status-left-length': PositiveIntOption('status_left_length', [20]),
     'window-status-format': StringOption('window_status_format'),
     'window-status-current-format': StringOption('window_status_current_format'),
-    'default-shell': StringOption(
-        'default_shell', [get_default_shell()]),
+    'default-shell': ShellPoolOption(StringOption(
+        'default_shell', [get_default_shell()])),
     'status-justify': JustifyOption('status_justify'),
+    'shell-pool-size': ShellPoolOption(PositiveIntOption('shell_pool_size', [0, 1, 2, 4])),
+    'vt-parser': ShellPoolOption(VtParserOption('vt_parser')),
 }
@@ -4,27 +4,252 @@ The child process.
 from __future__ import unicode_literals
 
 from prompt_toolkit.eventloop.base import EventLoop
-from prompt_toolkit.eventloop.posix_utils import PosixStdinReader
 from prompt_toolkit.document import Document
-from pygments.token import Token
 
 from .key_mappings import prompt_toolkit_key_to_vt100_key
 from .screen import BetterScreen
+from .search import get_line_text
 from .stream import BetterStream
 from .utils import set_terminal_size, pty_make_controlling_tty
 
+import codecs
+import datetime
+import errno
+import fcntl
+import io
 import os
 import resource
+import select
 import signal
+import six
 import sys
 import time
-import traceback
 
 __all__ = (
+    'ChildReaper',
+    'ExecError',
     'Process',
+    'ProcessInfoCache',
+    'PtyReader',
 )
 
 
+# `posix_spawn` is used when available. Only on Linux, the pty becomes the
+# controlling terminal of the child by opening it after `setsid`.
+_HAS_POSIX_SPAWN = hasattr(os, 'posix_spawn') and sys.platform.startswith('linux')
+
+_executable_cache = {}  # Maps (PATH, name) tuples to the executable.
+
+
+def find_executable(name, path):
+    """
+    Look for the executable `name` in the directories of the `path` string.
+    (Similar to how a shell looks in `PATH`.) Return `None` when not found.
+
+    The result is cached, only the cached executable is checked again.
+    """
+    key = (path, name)
+    executable = _executable_cache.get(key)
+
+    if executable and os.access(executable, os.X_OK):
+        return executable
+
+    for p in path.split(':'):
+        executable = os.path.join(p, name)
+        if os.path.exists(executable) and os.access(executable, os.X_OK):
+            _executable_cache[key] = executable
+            return executable
+
+
+def _is_current_directory(path):
+    """
+    True when `path` is the working directory of the server.
+    """
+    try:
+        return os.path.samefile(path, os.curdir)
+    except OSError:
+        return False  # No such directory, or our own directory was removed.
+
+
+class PtyReader(object):
+    """
+    Read from the master side of a pseudo terminal, and decode the UTF-8
+    output of the process.
+
+    Reads go into one reusable buffer, and an incremental decoder takes care
+    of multibyte sequences that are split across two reads.
+
+    :param fd: File descriptor. (Should be non blocking.)
+    :param buffer_size: Maximum amount of bytes for one read.
+    """
+    def __init__(self, fd, buffer_size=16 * 1024):
+        assert isinstance(fd, int)
+        assert isinstance(buffer_size, int) and buffer_size > 0
+
+        self.fd = fd
+        self.buffer_size = buffer_size
+        self.closed = False
+        self.bytes_read = 0  # Total, before decoding.
+
+        self._file = io.FileIO(fd, 'rb', closefd=False)
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+    def read(self, count=None):
+        """
+        Read at most `count` bytes, and return the decoded text. This can be
+        an empty string when only the start of a multibyte sequence was read.
+
+        Return `None` when nothing is available. (The read would block.) At
+        the end of the stream, `closed` becomes `True`.
+        """
+        count = min(count or self.buffer_size, self.buffer_size)
+
+        try:
+            size = self._file.readinto(self._view[:count])
+        except (IOError, OSError) as e:
+            if e.errno == errno.EINTR:
+                # Interrupted by a signal, like SIGWINCH or SIGCHLD.
+                return None
+            # EIO: the slave side has been closed.
+            size = 0
+
+        if size is None:
+            return None
+
+        self.bytes_read += size
+
+        if size == 0:
+            self.closed = True
+            return self._decoder.decode(b'', True)
+
+        if six.PY2:
+            return self._decoder.decode(self._view[:size].tobytes())
+        else:
+            return self._decoder.decode(self._view[:size])
+
+
+class ExecError(Exception):
+    """
+    Raised when the child process failed to execute its command.
+    """
+    def __init__(self, message):
+        self.message = message
+
+
+class ChildReaper(object):
+    """
+    Reap terminated child processes from the main thread.
+
+    A SIGCHLD handler writes to a self-pipe that is attached to the eventloop.
+    When the pipe becomes readable, a non blocking `waitpid` is done for
+    every registered PID, and the callback of the children that terminated is
+    called. (This replaces one executor thread per process, blocking in
+    `waitpid`.)
+
+    :param eventloop: Prompt_toolkit eventloop.
+    """
+    def __init__(self, eventloop):
+        assert isinstance(eventloop, EventLoop)
+
+        self.eventloop = eventloop
+        self._callbacks = {}  # Maps PID to callback.
+
+        # Create self-pipe.
+        self._pipe_r, self._pipe_w = os.pipe()
+
+        for fd in (self._pipe_r, self._pipe_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        signal.signal(signal.SIGCHLD, self._handle_sigchld)
+        eventloop.add_reader(self._pipe_r, self._reap)
+
+    def add(self, pid, callback):
+        """
+        Call `callback` in the main thread when the child with this PID
+        terminates.
+        """
+        assert isinstance(pid, int)
+        assert callable(callback)
+
+        # Note: when the child already terminated, the SIGCHLD handler did
+        #       write to the pipe, so it will still be reaped.
+        self._callbacks[pid] = callback
+
+    def _handle_sigchld(self, signum, frame):
+        """
+        Signal handler. Only wake up the eventloop here.
+        """
+        try:
+            os.write(self._pipe_w, b'x')
+        except OSError:
+            pass  # Pipe is full. The eventloop will wake up anyway.
+
+    def _reap(self):
+        """
+        Collect the terminated children. (Called by the eventloop.)
+        """
+        try:
+            os.read(self._pipe_r, 1024)
+        except OSError:
+            pass
+
+        # Only wait for our own children. (Other children of the server, like
+        # the ones started through `subprocess`, are reaped by their owner.)
+        for pid in list(self._callbacks):
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except OSError as e:
+                if e.errno != errno.ECHILD:
+                    continue
+                done = pid  # Already reaped.
+
+            if done == pid:
+                self._callbacks.pop(pid)()
+
+
+class ProcessInfoCache(object):
+    """
+    Cache for a value that we read from `/proc`, like the name or working
+    directory of a process.
+
+    The value is refreshed when the process showed activity (it produced
+    output or received input), but not more often than every `min_interval`
+    seconds. Otherwise it is refreshed after `max_age` seconds.
+
+    :param getter: Callable that returns the actual value.
+    """
+    def __init__(self, getter, min_interval=.5, max_age=3):
+        assert callable(getter)
+
+        self.getter = getter
+        self.min_interval = min_interval
+        self.max_age = max_age
+
+        self._value = None
+        self._time = 0
+        self._dirty = True
+
+    def invalidate(self):
+        """
+        Mark the value as outdated. (This is cheap, nothing is read until the
+        value is requested again.)
+        """
+        self._dirty = True
+
+    def get(self):
+        now = time.time()
+        age = now - self._time
+
+        if (self._dirty and age >= self.min_interval) or age >= self.max_age:
+            self._value = self.getter()
+            self._time = now
+            self._dirty = False
+
+        return self._value
+
+
 class Process(object):
     """
     Child process.
@@ -45,28 +270,118 @@ class Process(object):
         this calls execv.)
     :param bell_func: Called when the process does a `bell`.
     :param done_callback: Called when the process terminates.
+    :param child_reaper: :class:`.ChildReaper` instance. When not given, we
+        wait for the process to terminate in an executor thread.
+    :param read_budget: Maximum amount of bytes that are read from the
+        pseudo terminal during one eventloop tick. (Everything that is read
+        during one tick is fed to the stream at once, and causes only one
+        invalidation.)
+    :param max_parse_time: Maximum time (in seconds) that we spend parsing the
+        output of this process during one tick. What remains is parsed later,
+        when the eventloop has serviced the other panes and clients.
+    :param high_water_mark: When more than this amount of characters is waiting
+        to be parsed, stop reading from the pseudo terminal. (The kernel buffer
+        will fill up, and this throttles the child process.)
+    :param low_water_mark: Start reading again, once the amount of characters
+        that is waiting to be parsed drops below this value.
+    :param write_chunk_size: Maximum amount of bytes passed to one `write`
+        call on the pseudo terminal.
+    :param stream_class: The parser engine. `BetterStream` or a subclass.
+    :param read_size: Maximum amount of bytes for one read from the pseudo
+        terminal.
+    :param get_history_limit: Callable that returns the maximum number of
+        lines in the scrollback.
+    :param get_history_hot_lines: Callable that returns the number of lines
+        above the visible area that are kept unpacked. Older lines are
+        compressed. (See :class:`pymux.storage.DataBuffer`.)
+    :param history_spill: Write the lines that are removed from the history
+        to a temporary file. (See :class:`pymux.storage.SpillFile`.)
+    :param resize_delay: The size of the pseudo terminal (which sends SIGWINCH
+        to the child) is only changed when the size of the pane didn't change
+        for this many seconds. So, the child redraws only once after a burst
+        of resizes.
+    :param max_resize_delay: ... but the pseudo terminal is never more than
+        this many seconds behind.
     """
-    def __init__(self, eventloop, invalidate, exec_func, bell_func=None, done_callback=None):
+    def __init__(self, eventloop, invalidate, exec_func, bell_func=None, done_callback=None,
+                 child_reaper=None, read_budget=64 * 1024, max_parse_time=.02,
+                 high_water_mark=64 * 1024, low_water_mark=16 * 1024,
+                 write_chunk_size=16 * 1024, stream_class=BetterStream,
+                 read_size=16 * 1024, get_history_limit=None,
+                 get_history_hot_lines=None, history_spill=False,
+                 resize_delay=.1, max_resize_delay=.5):
         assert isinstance(eventloop, EventLoop)
         assert callable(invalidate)
         assert callable(exec_func)
         assert bell_func is None or callable(bell_func)
         assert done_callback is None or callable(done_callback)
+        assert child_reaper is None or isinstance(child_reaper, ChildReaper)
+        assert isinstance(read_budget, int) and read_budget > 0
+        assert isinstance(max_parse_time, (int, float)) and max_parse_time > 0
+        assert isinstance(high_water_mark, int)
+        assert isinstance(low_water_mark, int) and low_water_mark <= high_water_mark
+        assert isinstance(write_chunk_size, int) and write_chunk_size > 0
+        assert issubclass(stream_class, BetterStream)
+        assert isinstance(read_size, int) and read_size > 0
+        assert isinstance(resize_delay, (int, float)) and resize_delay >= 0
+        assert isinstance(max_resize_delay, (int, float)) and max_resize_delay >= resize_delay
 
         self.eventloop = eventloop
         self.invalidate = invalidate
         self.exec_func = exec_func
         self.done_callback = done_callback
+        self.child_reaper = child_reaper
         self.pid = None
         self.is_terminated = False
         self.suspended = False
         self.slow_motion = False  # For debugging
+        self.read_budget = read_budget
+        self.max_parse_time = max_parse_time
+        self.high_water_mark = high_water_mark
+        self.low_water_mark = low_water_mark
+        self.write_chunk_size = write_chunk_size
+        self.resize_delay = resize_delay
+        self.max_resize_delay = max_resize_delay
+
+        # Arguments for `posix_spawn`. (Set by `from_command`.)
+        self._spawn_args = None
+
+        # Flow control: output that has been read, but not yet parsed.
+        self.throttled = False
+        self._pending_output = ''
+        self._pending_output_scheduled = False
+
+        # Input that has been written by the user, but which has not yet been
+        # accepted by the pseudo terminal.
+        self._input_queue = bytearray()
+        self._waiting_until_writable = False
+
+        # Size of the pseudo terminal, as the child knows it. (`None` before
+        # it has been set.) The size that was requested during the last
+        # render. And the times of the first and the last resize that are not
+        # yet applied to the pseudo terminal.
+        self._pty_size = None
+        self._requested_size = None
+        self._resize_times = None
+
+        # Process name and working directory. (Rendering the status bar asks
+        # for the name of every window, every time.) For the working
+        # directory, we don't wait: it's only requested when a new pane is
+        # created, and that should start in the directory we just `cd`-ed to.
+        self._name_cache = ProcessInfoCache(
+            lambda: get_name_for_fd(self.master) if self.master is not None else None)
+        self._cwd_cache = ProcessInfoCache(
+            lambda: get_cwd_for_pid(self.pid), min_interval=0)
 
         # Create pseudo terminal for this pane.
         self.master, self.slave = os.openpty()
 
+        # Writing to the master should never block the server.
+        fcntl.fcntl(self.master, fcntl.F_SETFL,
+                    fcntl.fcntl(self.master, fcntl.F_GETFL) | os.O_NONBLOCK)
+
         # Master side -> attached to terminal emulator.
-        self._reader = PosixStdinReader(self.master)
+        self._reader = PtyReader(self.master, buffer_size=read_size)
 
         # Create output stream and attach to screen
         self.sx = 120
@@ -74,9 +389,12 @@ class Process(object):
 
         self.screen = BetterScreen(self.sx, self.sy,
                                    write_process_input=self.write_input,
-                                   bell_func=bell_func)
+                                   bell_func=bell_func,
+                                   get_history_limit=get_history_limit,
+                                   get_history_hot_lines=get_history_hot_lines,
+                                   history_spill=history_spill)
 
-        self.stream = BetterStream(self.screen)
+        self.stream = stream_class(self.screen)
         self.stream.attach(self.screen)
 
     def start(self):
@@ -90,116 +408,291 @@ class Process(object):
 
     @classmethod
     def from_command(cls, eventloop, invalidate, command, done_callback,
-                     bell_func=None, before_exec_func=None):
+                     bell_func=None, before_exec_func=None, child_reaper=None,
+                     cwd=None, env=None, stream_class=BetterStream,
+                     get_history_limit=None, get_history_hot_lines=None,
+                     history_spill=False, read_budget=64 * 1024):
         """
         Create Process from command,
         e.g. command=['python', '-c', 'print("test")']
 
+        When no `before_exec_func` has been given, the platform supports it
+        and the process starts in the working directory of the server, the
+        process is started using `posix_spawn`. This avoids a fork of
+        the whole pymux server. The executable is looked up in the parent,
+        using a cached `PATH` lookup.
+
+        Raises :class:`.ExecError` when the executable can't be found.
+
         :param before_exec_func: Function that is called before `exec` in the process fork.
+        :param cwd: Working directory for the new process.
+        :param env: Dictionary with the environment variables for the new
+            process. (`os.environ` by default.) This dictionary is only read
+            when the process is started, so it can still be modified before
+            calling `start`.
+        :param stream_class: The parser engine. (See :class:`.Process`.)
+        :param get_history_limit: (See :class:`.Process`.)
+        :param get_history_hot_lines: (See :class:`.Process`.)
+        :param history_spill: (See :class:`.Process`.)
+        :param read_budget: (See :class:`.Process`.)
         """
         assert isinstance(command, list)
+        assert before_exec_func is None or callable(before_exec_func)
+        assert env is None or isinstance(env, dict)
+
+        if env is None:
+            env = dict(os.environ)
+
+        path = find_executable(command[0], env.get('PATH', os.defpath))
+
+        if path is None:
+            raise ExecError('Command not found: %s' % command[0])
 
         def execv():
             if before_exec_func:
                 before_exec_func()
 
-            for p in os.environ['PATH'].split(':'):
-                path = os.path.join(p, command[0])
-                if os.path.exists(path) and os.access(path, os.X_OK):
-                    os.execv(path, command)
+            if cwd:
+                try:
+                    os.chdir(cwd)
+                except OSError:
+                    pass  # No such file or directory.
+
+            os.execve(path, command, env)
 
-        return cls(eventloop, invalidate, execv,
-                   bell_func=bell_func, done_callback=done_callback)
+        process = cls(eventloop, invalidate, execv,
+                      bell_func=bell_func, done_callback=done_callback,
+                      child_reaper=child_reaper, stream_class=stream_class,
+                      get_history_limit=get_history_limit,
+                      get_history_hot_lines=get_history_hot_lines,
+                      history_spill=history_spill,
+                      read_budget=read_budget)
+
+        if (before_exec_func is None and _HAS_POSIX_SPAWN and
+                (not cwd or _is_current_directory(cwd))):
+            process._spawn_args = (path, command, env)
+
+        return process
 
     def _start(self):
+        """
+        Start the child process.
+        """
+        if self._spawn_args:
+            self._posix_spawn(*self._spawn_args)
+        else:
+            self._fork()
+
+    def _posix_spawn(self, path, command, env):
+        """
+        Start the child process using `posix_spawn`.
+
+        The child becomes a session leader, and because it opens the slave
+        side of the pty as the first terminal, this becomes its controlling
+        terminal. (Our own file descriptors are not inheritable, so they are
+        closed during `exec`.) There is no file action for changing the
+        working directory, so the child starts in the directory of the server.
+        """
+        file_actions = [
+            (os.POSIX_SPAWN_OPEN, 0, os.ttyname(self.slave), os.O_RDWR, 0),
+            (os.POSIX_SPAWN_DUP2, 0, 1),
+            (os.POSIX_SPAWN_DUP2, 0, 2),
+        ]
+
+        try:
+            pid = os.posix_spawn(path, command, env, file_actions=file_actions,
+                                 setsid=True, setsigdef=(signal.SIGPIPE, ))
+        except OSError as e:
+            os.close(self.master)
+            self.master = None
+            raise ExecError('%s' % (e, ))
+        finally:
+            os.close(self.slave)
+            self.slave = None
+
+        self.pid = pid
+
+    def _fork(self):
         """
         Create fork and start the child process.
+
+        The child reports back through a status pipe, which is closed
+        automatically when `exec` succeeds (close-on-exec), or which receives
+        an error message when it fails. We wait for this, so that we know that
+        the child doesn't share our signal handlers and FDs anymore.
+        (Resizing the pty, when the child is still in our Python code and has
+        the signal handler from prompt_toolkit, but closed the 'fd' for
+        'call_from_executor', will cause OSError.)
+
+        Raises :class:`.ExecError` when the child could not be started.
         """
+        status_r, status_w = os.pipe()
+        fcntl.fcntl(status_w, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+
         pid = os.fork()
 
         if pid == 0:
-            self._in_child()
+            os.close(status_r)
+            self._in_child(status_w)
         elif pid > 0:
             # In parent.
+            os.close(status_w)
             os.close(self.slave)
             self.slave = None
 
-            # We wait a very short while, to be sure the child had the time to
-            # call _exec. (Otherwise, we are still sharing signal handlers and
-            # FDs.) Resizing the pty, when the child is still in our Python
-            # code and has the signal handler from prompt_toolkit, but closed
-            # the 'fd' for 'call_from_executor', will cause OSError.
-            time.sleep(0.1)
+            # Wait for the status pipe to be closed.
+            error = b''
+            while True:
+                try:
+                    data = os.read(status_r, 4096)
+                except OSError as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                if not data:
+                    break
+                error += data
+            os.close(status_r)
+
+            if error:
+                # Exec failed, the child terminates right away.
+                os.waitpid(pid, 0)
+                os.close(self.master)
+                self.master = None
+                raise ExecError(error.decode('utf-8', 'ignore'))
 
             self.pid = pid
 
     def _waitpid(self):
         """
-        Create an executor that waits and handles process termination.
+        Handle process termination. Register the PID with the child reaper,
+        or create an executor that waits for the process.
         """
-        def wait_for_finished():
-            " Wait for PID in executor. "
-            os.waitpid(self.pid, 0)
-            self.eventloop.call_from_executor(done)
+        if self.child_reaper:
+            self.child_reaper.add(self.pid, self._done)
+        else:
+            def wait_for_finished():
+                " Wait for PID in executor. "
+                os.waitpid(self.pid, 0)
+                self.eventloop.call_from_executor(self._done)
 
-        def done():
-            " PID received. Back in the main thread. "
-            # Close pty and remove reader.
-            os.close(self.master)
-            self.eventloop.remove_reader(self.master)
-            self.master = None
+            self.eventloop.run_in_executor(wait_for_finished)
 
-            # Callback.
-            self.is_terminated = True
-            self.done_callback()
+    def _done(self):
+        " PID received. Back in the main thread. "
+        # Parse everything that is still pending, including the output
+        # that is still in the kernel buffer.
+        self.stream.feed(self._pending_output + self._drain(self.high_water_mark))
+        self._pending_output = ''
 
-        self.eventloop.run_in_executor(wait_for_finished)
+        # Close pty and remove reader.
+        os.close(self.master)
+        self.eventloop.remove_reader(self.master)
+        self.master = None
+
+        # Callback.
+        self.is_terminated = True
+        self.done_callback()
 
     def set_size(self, width, height):
         """
-        Set terminal size.
+        Set terminal size. (Called for every render, but nothing happens
+        when the size didn't change.)
+
+        The screen is resized right away. The pseudo terminal is resized
+        after `resize_delay` seconds without another resize. (Before the
+        child has been started, right away.)
         """
         assert isinstance(width, int)
         assert isinstance(height, int)
 
-        if self.master is not None:
-            set_terminal_size(self.master, height, width)
         self.screen.resize(lines=height, columns=width)
 
-        self.screen.lines = height
-        self.screen.columns = width
-
         self.sx = width
         self.sy = height
 
-    def _in_child(self):
-        " Will be executed in the forked child. "
-        os.close(self.master)
+        if (width, height) != self._pty_size:
+            if self.pid is None:
+                self._set_pty_size()
+            else:
+                now = time.time()
 
-        # Remove signal handler for SIGWINCH as early as possible.
-        # (We don't want this to be triggered when execv has not been called
-        # yet.)
-        signal.signal(signal.SIGWINCH, 0)
+                if self._resize_times is None:
+                    self._resize_times = (now, now)
+                    self._wait_for_resize(self.resize_delay)
+                elif (width, height) != self._requested_size:
+                    self._resize_times = (self._resize_times[0], now)
 
-        pty_make_controlling_tty(self.slave)
+        self._requested_size = (width, height)
 
-        # In the fork, set the stdin/out/err to our slave pty.
-        os.dup2(self.slave, 0)
-        os.dup2(self.slave, 1)
-        os.dup2(self.slave, 2)
+    def _wait_for_resize(self, timeout):
+        """
+        Call `_resize_timeout` in the main thread, after `timeout` seconds.
+        """
+        def wait():
+            time.sleep(timeout)
+            self.eventloop.call_from_executor(self._resize_timeout)
+
+        self.eventloop.run_in_executor(wait)
+
+    def _resize_timeout(self):
+        """
+        Resize the pseudo terminal, unless the size changed again in the
+        meantime. In that case, wait a little longer.
+        """
+        first, last = self._resize_times
+        remaining = min(last + self.resize_delay, first + self.max_resize_delay) - time.time()
+
+        if remaining > 0:
+            self._wait_for_resize(remaining)
+        else:
+            self._resize_times = None
+            self._set_pty_size()
+
+    def _set_pty_size(self):
+        """
+        Set the size of the pseudo terminal, if it changed. (The kernel
+        sends SIGWINCH to the child.)
+        """
+        size = (self.sx, self.sy)
+
+        if self.master is not None and size != self._pty_size:
+            set_terminal_size(self.master, self.sy, self.sx)
+            self._pty_size = size
 
-        # Execute in child.
+    def _in_child(self, status_fd):
+        """
+        Will be executed in the forked child.
+
+        :param status_fd: Write end of the status pipe. When anything goes
+            wrong, the error is reported through this pipe.
+        """
         try:
-            self._close_file_descriptors()
-            self.exec_func()
-        except Exception:
-            traceback.print_exc()
-            time.sleep(5)
+            os.close(self.master)
+
+            # Remove signal handler for SIGWINCH as early as possible.
+            # (We don't want this to be triggered when execv has not been called
+            # yet.)
+            signal.signal(signal.SIGWINCH, 0)
 
-            os._exit(1)
+            pty_make_controlling_tty(self.slave)
+
+            # In the fork, set the stdin/out/err to our slave pty.
+            os.dup2(self.slave, 0)
+            os.dup2(self.slave, 1)
+            os.dup2(self.slave, 2)
+
+            # Execute in child.
+            self._close_file_descriptors(keep_fd=status_fd)
+            self.exec_func()
+        except BaseException as e:
+            try:
+                os.write(status_fd, ('%s' % (e, )).encode('utf-8') or b'?')
+            finally:
+                os._exit(1)
         os._exit(0)
 
-    def _close_file_descriptors(self):
+    def _close_file_descriptors(self, keep_fd):
         # Do not allow child to inherit open file descriptors from parent.
         # (In case that we keep running Python code. We shouldn't close them.
         # because the garbage collector is still active, and he will close them
@@ -207,13 +700,14 @@ class Process(object):
         max_fd = resource.getrlimit(resource.RLIMIT_NOFILE)[-1]
 
         try:
-            os.closerange(3, max_fd)
+            os.closerange(3, keep_fd)
+            os.closerange(keep_fd + 1, max_fd)
         except OverflowError:
             # On OS X, max_fd can return very big values, than closerange
             # doesn't understand, e.g. 9223372036854775807. In this case, just
             # use 4096. This is what Linux systems report, and should be
             # sufficient. (I hope...)
-            os.closerange(3, 4096)
+            os.closerange(keep_fd + 1, 4096)
 
     def write_input(self, data, paste=False):
         """
@@ -227,15 +721,66 @@ class Process(object):
         if paste and self.screen.bracketed_paste_enabled:
             data = '\x1b[200~' + data + '\x1b[201~'
 
-        while self.master is not None:
+        self._input_queue.extend(data.encode('utf-8'))
+        self._flush_input()
+        self._invalidate_info()
+
+    @property
+    def input_queue_size(self):
+        """
+        Amount of bytes that have been sent to this process, but which have
+        not yet been accepted by the pseudo terminal.
+        """
+        return len(self._input_queue)
+
+    def _flush_input(self):
+        """
+        Write as much of the input queue to the pseudo terminal as possible,
+        without blocking. When the kernel buffer is full (the process doesn't
+        read its input), wait in an executor until the pty becomes writable
+        again, and continue from there.
+        """
+        while self._input_queue and self.master is not None:
             try:
-                os.write(self.master, data.encode('utf-8'))
+                written = os.write(self.master, bytes(self._input_queue[:self.write_chunk_size]))
             except OSError as e:
-                # This happens when the window resizes and a SIGWINCH was received.
-                # We get 'Error: [Errno 4] Interrupted system call'
-                if e.errno == 4:
+                if e.errno == errno.EINTR:
+                    # This happens when the window resizes and a SIGWINCH was received.
                     continue
-            return
+                elif e.errno == errno.EAGAIN:
+                    break
+                else:
+                    # The process is gone, drop the remaining input.
+                    del self._input_queue[:]
+                    break
+            else:
+                del self._input_queue[:written]
+
+        if self.master is None:
+            del self._input_queue[:]
+
+        if self._input_queue and not self._waiting_until_writable:
+            self._waiting_until_writable = True
+            master = self.master
+
+            def wait_until_writable():
+                # Use a timeout, so that we stop waiting when the process
+                # terminates in the meantime.
+                while self.master == master:
+                    try:
+                        if select.select([], [master], [], 1)[1]:
+                            break
+                    except (OSError, select.error, ValueError):
+                        break  # The pty was closed.
+
+                self.eventloop.call_from_executor(writable)
+
+            def writable():
+                self._waiting_until_writable = False
+                self._flush_input()
+                self.invalidate()
+
+            self.eventloop.run_in_executor(wait_until_writable)
 
     def write_key(self, key):
         """
@@ -245,27 +790,40 @@ class Process(object):
             key, application_mode=self.screen.in_application_mode)
         self.write_input(data)
 
+    @property
+    def pending_output_size(self):
+        """
+        Amount of characters that have been read from the process, but which
+        are still waiting to be parsed.
+        """
+        return len(self._pending_output)
+
     def _connect_reader(self):
         """
         Process stdout output from the process.
         """
-        if self.master is not None:
+        if self.master is not None and not self.suspended and not self.throttled:
             self.eventloop.add_reader(self.master, self._read)
 
     def _read(self):
         """
         Read callback, called by the eventloop.
         """
+        if self.master is None:
+            return  # Process terminated during this eventloop iteration.
+
         if self.slow_motion:
             # Read characters one-by-one in slow motion.
             d = self._reader.read(1)
         else:
-            d = self._reader.read()
+            d = self._drain(self.read_budget)
 
         if d:
-            self.stream.feed(d)
-            self.invalidate()
-        else:
+            self._pending_output += d
+            self._process_pending_output()
+            self._invalidate_info()
+
+        if self._reader.closed:
             # End of stream. Remove child.
             self.eventloop.remove_reader(self.master)
 
@@ -278,6 +836,76 @@ class Process(object):
                 self.eventloop.call_from_executor(self._connect_reader)
             self.eventloop.run_in_executor(connect_with_delay)
 
+    def _drain(self, budget):
+        """
+        Keep reading from the pseudo terminal until there is nothing left, or
+        until `budget` bytes have been read. Return everything as one
+        (decoded) string.
+
+        (A chatty process, like `cat` of a big file, would otherwise trigger a
+        redraw for every small chunk that the kernel hands us.)
+        """
+        reader = self._reader
+        chunks = []
+        end = reader.bytes_read + budget
+
+        # Stop when the next read would block. (The master is non blocking.)
+        while reader.bytes_read < end and not reader.closed:
+            d = reader.read(end - reader.bytes_read)
+            if d is None:
+                break
+
+            chunks.append(d)
+
+        return ''.join(chunks)
+
+    def _process_pending_output(self):
+        """
+        Feed the pending output to the stream, but don't spend more than
+        `max_parse_time` seconds. When too much output is pending, stop
+        reading from the pseudo terminal until we have caught up.
+        """
+        self._pending_output_scheduled = False
+
+        # Don't touch the screen while the process is suspended. (Copy mode
+        # reads the rows of the screen while it's shown.) `resume` continues.
+        if self.suspended:
+            return
+
+        data = self._pending_output
+        start = time.time()
+        pos = 0
+
+        while pos < len(data):
+            self.stream.feed(data[pos:pos + 4096])
+            pos += 4096
+
+            if time.time() - start > self.max_parse_time:
+                break
+
+        self._pending_output = data[pos:]
+        pending = len(self._pending_output)
+
+        if pos:
+            self.invalidate()
+
+        # High/low water marks.
+        if pending > self.high_water_mark and not self.throttled:
+            self.throttled = True
+            self.eventloop.remove_reader(self.master)
+
+        elif pending <= self.low_water_mark and self.throttled:
+            self.throttled = False
+            self._connect_reader()
+
+        # Parse the remaining output later. Schedule this as a low priority
+        # task, so that other panes and clients are serviced first.
+        if pending and not self._pending_output_scheduled:
+            self._pending_output_scheduled = True
+            self.eventloop.call_from_executor(
+                self._process_pending_output,
+                _max_postpone_until=datetime.datetime.now() + datetime.timedelta(seconds=.5))
+
     def suspend(self):
         """
         Suspend process. Stop reading stdout. (Called when going into copy mode.)
@@ -290,23 +918,33 @@ class Process(object):
         Resume from 'suspend'.
         """
         if self.suspended and self.master is not None:
-            self._connect_reader()
             self.suspended = False
+            self._connect_reader()
+
+            # Parse the output that was read before suspending.
+            if self._pending_output:
+                self._process_pending_output()
+
+    def _invalidate_info(self):
+        """
+        Activity in this process. The name or working directory could have
+        changed.
+        """
+        self._name_cache.invalidate()
+        self._cwd_cache.invalidate()
 
     def get_cwd(self):
         """
         The current working directory for this process. (Or `None` when
         unknown.)
         """
-        return get_cwd_for_pid(self.pid)
+        return self._cwd_cache.get()
 
     def get_name(self):
         """
         The name for this process. (Or `None` when unknown.)
         """
-        # TODO: Maybe cache for short time.
-        if self.master is not None:
-            return get_name_for_fd(self.master)
+        return self._name_cache.get()
 
     def send_signal(self, signal):
         " Send signal to running process. "
@@ -317,14 +955,21 @@ class Process(object):
 
     def create_copy_document(self):
         """
-        Create a Document instance and token list that can be used in copy
-        mode.
+        Create a Document instance that can be used in copy mode. (Only the
+        text, the colors are read from the screen while rendering.)
+
+        Note that this still reads every line of the history, so entering
+        copy mode takes time proportional to the size of the history. (The
+        `Buffer` of copy mode needs the whole text for searching, moving the
+        cursor and the selection.)
         """
+        # (After a resize, the history was not yet wrapped again.)
+        self.screen.reflow_history()
+
         data_buffer = self.screen.pt_screen.data_buffer
-        text = []
-        token_list = []
+        lines = []
 
-        first_row = min(data_buffer.keys())
+        first_row = data_buffer.first_line  # (Including the spilled lines.)
         last_row = max(data_buffer.keys())
 
         def token_has_no_background(token):
@@ -335,44 +980,30 @@ class Process(object):
                 return True
 
         for row_index in range(first_row, last_row + 1):
-            row = data_buffer[row_index]
-            max_column = max(row.keys()) if row else 0
+            row = data_buffer.get_line(row_index)  # (Don't unpack old lines.)
+            end = len(row)
 
             # Remove trailing whitespace. (If the background is transparent.)
-            row_data = [row[x] for x in range(0, max_column + 1)]
-
-            while (row_data and row_data[-1].char.isspace() and
-                   token_has_no_background(row_data[-1].token)):
-                row_data.pop()
-
-            # Walk through row.
-            char_iter = iter(range(len(row_data)))
+            while (end > 0 and row.chars[end - 1].isspace() and
+                   token_has_no_background(row[end - 1].token)):
+                end -= 1
 
-            for x in char_iter:
-                c = row[x]
-                text.append(c.char)
-                token_list.append((c.token, c.char))
-
-                # Skip next cell when this is a double width character.
-                if c.width == 2:
-                    next(char_iter)
-
-            # Add newline.
-            text.append('\n')
-            token_list.append((Token, '\n'))
+            lines.append(get_line_text(row, end))
 
         # Remove newlines at the end.
-        while text and text[-1] == '\n':
-            text.pop()
-            token_list.pop()
+        while lines and not lines[-1]:
+            lines.pop()
+
+        # Calculate cursor position. (Like `Document.translate_row_col_to_index`,
+        # but without splitting the text again.)
+        text = '\n'.join(lines)
+        row = self.screen.pt_screen.cursor_position.y - first_row
+        cursor_position = self.screen.pt_screen.cursor_position.x
 
-        # Calculate cursor position.
-        d = Document(text=''.join(text))
+        if row > 0:
+            cursor_position += sum(len(l) for l in lines[:row]) + min(row, len(lines))
 
-        return Document(text=d.text,
-                        cursor_position=d.translate_row_col_to_index(
-                            row=self.screen.pt_screen.cursor_position.y,
-                            col=self.screen.pt_screen.cursor_position.x)), token_list
+        return Document(text=text, cursor_position=max(0, min(cursor_position, len(text))))
 
 
 def get_cwd_for_pid(pid):
@@ -64,6 +64,7 @@ bind-key M-o rotate-window -D
 bind-key C-b send-prefix
 bind-key . command-prompt "move-window -t '%%'"
 bind-key [ copy-mode
+bind-key f command-prompt -p find-window "find-window '%%'"
 bind-key ] paste-buffer
 bind-key ? list-keys
 
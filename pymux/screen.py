@@ -5,9 +5,9 @@ Changes compared to the original `Screen` class:
     - We store the layout in a prompt_toolkit.layout.screen.Screen instance.
       This allows fast rendering in a prompt_toolkit user control.
     - 256 colour support (xterm)
+    - Soft wrapped lines are wrapped again when the number of columns changes.
 """
 from __future__ import unicode_literals
-from collections import defaultdict
 
 from pygments.formatters.terminal256 import Terminal256Formatter
 from pyte import charsets as cs
@@ -19,17 +19,25 @@ from prompt_toolkit.layout.screen import Screen, Char
 from prompt_toolkit.styles import Attrs
 from prompt_toolkit.terminal.vt100_output import FG_ANSI_COLORS, BG_ANSI_COLORS
 from prompt_toolkit.utils import get_cwidth
-from collections import namedtuple
+from collections import namedtuple, deque
+
+from .search import SearchIndex
+from .storage import DEFAULT_STYLE, DEFAULT_TOKEN, DataBuffer, Row, SpillFile, intern_token, rewrap_rows
 
 import copy
+import re
 
 __all__ = (
     'BetterScreen',
     'DEFAULT_TOKEN',
 )
 
-DEFAULT_TOKEN = ('C', ) + Attrs(color=None, bgcolor=None, bold=False, underline=False,
-                                italic=False, blink=False, reverse=False)
+# Printable ASCII. These characters always take exactly one cell.
+_ascii_run_re = re.compile('[ -~]+')
+
+# When a resize wraps the lines again, at most this many lines above the
+# screen are included, for a logical line that starts above the screen.
+_REFLOW_LOOKBACK = 1000
 
 
 class CursorPosition(object):
@@ -42,6 +50,58 @@ class CursorPosition(object):
         return 'pymux.CursorPosition(x=%r, y=%r)' % (self.x, self.y)
 
 
+class DamageLog(object):
+    """
+    Keeps track of the lines of a screen that were changed, so that the
+    renderer only has to read those lines again.
+
+    Every renderer (there is one for every attached client) remembers the
+    generation number that it received from :meth:`get_changes` during the
+    previous render, and passes it back the next time.
+
+    :param max_history: Number of generations to remember. A renderer that
+        is further behind gets `None`: it has to redraw everything.
+    """
+    def __init__(self, max_history=16):
+        self.lines = set()  # Lines that changed since the last `get_changes`.
+        self.everything = True  # When set, `lines` doesn't matter.
+        self.generation = 0
+        self._history = deque(maxlen=max_history)  # (generation, lines) tuples.
+
+    def add_range(self, first, last):
+        " Mark the lines from `first` until `last` (inclusive) as changed. "
+        self.lines.update(range(first, last + 1))
+
+    def add_all(self):
+        " Mark everything as changed. "
+        self.everything = True
+        self.lines = set()
+
+    def get_changes(self, since):
+        """
+        Return a (generation, lines) tuple. `lines` is the set of line numbers
+        that changed since the generation `since` (as returned by a previous
+        call), or `None` when everything has to be redrawn.
+        """
+        if self.everything or self.lines:
+            self._history.append((self.generation, None if self.everything else self.lines))
+            self.generation += 1
+            self.lines = set()
+            self.everything = False
+
+        if since is None or (self._history and since < self._history[0][0]):
+            return self.generation, None
+
+        result = set()
+        for generation, lines in self._history:
+            if generation >= since:
+                if lines is None:
+                    return self.generation, None
+                result.update(lines)
+
+        return self.generation, result
+
+
 # Custom Savepoint that also stores the Attrs.
 _Savepoint = namedtuple("_Savepoint", [
     'cursor',
@@ -62,6 +122,11 @@ class BetterScreen(object):
     The data buffer is stored in a :class:`prompt_toolkit.layout.screen.Screen`
     class, because this way, we can send it to the renderer without any
     transformation.
+
+    :param history_spill: When `True`, the lines that are removed from the
+        history are written to a temporary file, instead of being discarded.
+        (Only for the main screen, not for the alternate screen.) Call
+        :meth:`close` to remove the file.
     """
     swap_variables = [
         'mode',
@@ -72,19 +137,25 @@ class BetterScreen(object):
         'tabstops',
         'line_offset',
         'data_buffer',
+        'search_index',
         'max_y',
+        '_wrap_columns',
+        '_reflow_history_before',
     ]
 
     def __init__(self, lines, columns, write_process_input, bell_func=None,
-                 get_history_limit=None):
+                 get_history_limit=None, get_history_hot_lines=None,
+                 history_spill=False):
         assert isinstance(lines, int)
         assert isinstance(columns, int)
         assert callable(write_process_input)
         assert bell_func is None or callable(bell_func)
         assert get_history_limit is None or callable(get_history_limit)
+        assert get_history_hot_lines is None or callable(get_history_hot_lines)
 
         bell_func = bell_func or (lambda: None)
         get_history_limit = get_history_limit or (lambda: 2000)
+        get_history_hot_lines = get_history_hot_lines or (lambda: 1000)
 
         self.savepoints = []
         self.lines = lines
@@ -92,6 +163,12 @@ class BetterScreen(object):
         self.write_process_input = write_process_input
         self.bell_func = bell_func
         self.get_history_limit = get_history_limit
+        self.get_history_hot_lines = get_history_hot_lines
+        self.history_spill = history_spill
+        self.damage = DamageLog()
+
+        self.data_buffer = None
+        self._original_screen = None
         self.reset()
 
     def __after__(self, ev):
@@ -146,6 +223,12 @@ class BetterScreen(object):
            and tabstops should be reset as well, thanks to
            :manpage:`xterm` -- we now know that.
         """
+        # The history of the current screen is discarded.
+        self.close()
+
+        # The original Screen instance, when going to the alternate screen.
+        self._original_screen = None
+
         self._reset_screen()
 
         self.title = ''
@@ -176,9 +259,6 @@ class BetterScreen(object):
         # relies on the stops to be there.)
         self.tabstops = set(range(8, 1000, 8))
 
-        # The original Screen instance, when going to the alternate screen.
-        self._original_screen = None
-
     def _reset_screen(self):
         """ Reset the Screen content. (also called when switching from/to
         alternate buffer. """
@@ -186,8 +266,16 @@ class BetterScreen(object):
 
         self.pt_screen.cursor_position = CursorPosition(0, 0)
         self.pt_screen.show_cursor = True
+        self.damage.add_all()
 
+        # Compact storage. (Instead of a dictionary of `Char` instances for
+        # every row.)
+        if self.history_spill and not self._in_alternate_screen:
+            self.pt_screen.data_buffer = DataBuffer(spill=SpillFile())
+        else:
+            self.pt_screen.data_buffer = DataBuffer()
         self.data_buffer = self.pt_screen.data_buffer
+        self.search_index = SearchIndex(self.data_buffer)
 
         self._attrs = Attrs(color=None, bgcolor=None, bold=False,
                             underline=False, italic=False, blink=False, reverse=False)
@@ -197,6 +285,23 @@ class BetterScreen(object):
         self.line_offset = 0  # Index of the line that's currently displayed on top.
         self.max_y = 0  # Max 'y' position to which is written.
 
+        # Number of columns for which the lines of `data_buffer` are wrapped,
+        # and the line before which the history still has to be wrapped
+        # again. (`None` when the history is up to date.)
+        self._wrap_columns = self.columns
+        self._reflow_history_before = None
+
+    def _get_attrs(self):
+        return self._current_attrs
+
+    def _set_attrs(self, attrs):
+        # Resolve the style ID once, when the attributes change. (Not for
+        # every character that is drawn.)
+        self._current_attrs = attrs
+        self._style = intern_token(('C', ) + attrs)
+
+    _attrs = property(_get_attrs, _set_attrs)
+
     def resize(self, lines=None, columns=None):
         # don't do anything except saving the dimensions
         lines = lines if lines is not None else self.lines
@@ -210,7 +315,105 @@ class BetterScreen(object):
             self.lines = lines
             self.columns = columns
 
+            self._reflow_screen()
             self._reset_offset_and_margins()
+            self.damage.add_all()
+
+    def _reflow_screen(self):
+        """
+        Wrap the lines of the screen again, after the number of columns
+        changed. Only the lines that become visible are done now; the rest
+        of the history is done by :meth:`reflow_history`, when it's needed.
+        So, a lot of resizes after each other don't go through the whole
+        history every time. (The alternate screen is not wrapped again, the
+        application redraws it.)
+        """
+        if self._in_alternate_screen or self._wrap_columns == self.columns:
+            return
+
+        self._wrap_columns = self.columns
+
+        data_buffer = self.data_buffer
+        first_line = next(iter(data_buffer), 0)
+        start = end = max(self.max_y, self.pt_screen.cursor_position.y) + 1
+
+        # Start with the lines at the bottom. Wrapping them can change their
+        # number, so continue upwards until the screen is filled.
+        while True:
+            top = max(first_line, end - self.lines)
+
+            if top >= start:
+                break
+
+            # Include the start of the logical line that contains `top`.
+            limit = max(first_line, top - _REFLOW_LOOKBACK)
+            while top > limit and data_buffer.get_line(top - 1).wrapped:
+                top -= 1
+
+            end += self._reflow(top, start)
+            start = top
+
+        self.max_y = end - 1
+
+        if start > first_line:
+            self._reflow_history_before = start
+        else:
+            self._reflow_history_before = None
+
+        self.search_index.add_lines_before(start)  # Forget the lines that moved.
+
+    def reflow_history(self):
+        """
+        Wrap the lines of the history again for the current number of
+        columns, when that was not done yet after a resize. Call this before
+        reading the history. (The lines that are written to the spill file
+        keep their width.)
+        """
+        end = self._reflow_history_before
+
+        if end is not None:
+            self._reflow_history_before = None
+            start = next(iter(self.data_buffer), end)
+
+            if start < end:
+                self._reflow(start, end)
+                self.damage.add_all()
+
+                # Index the history again, and apply the history limit.
+                self.search_index.add_lines_before(start)
+                self._remove_old_lines_from_history()
+
+    def _reflow(self, start, end):
+        """
+        Wrap the lines from `start` until `end` (exclusive) again for the
+        current number of columns. The lines after them move. Return the
+        number of lines that were added. (Negative when lines were removed.)
+        """
+        cursors = [self.pt_screen.cursor_position] + [s.cursor for s in self.savepoints]
+        inside = [c for c in cursors if start <= c.y < end]
+
+        rows, positions = rewrap_rows(
+            [self.data_buffer.get_line(y) for y in range(start, end)],
+            self.columns, [(c.y - start, c.x) for c in inside])
+
+        self.data_buffer.replace_lines(start, end, rows)
+        delta = len(rows) - (end - start)
+
+        for c in cursors:
+            if c.y >= end:
+                c.y += delta
+
+        for c, (y, x) in zip(inside, positions):
+            c.y = start + y
+            c.x = x
+
+        if self.line_offset >= end:
+            self.line_offset += delta
+
+        if self.max_y >= end:
+            self.max_y += delta
+
+        return delta
 
     def set_margins(self, top=None, bottom=None):
         """Selects top and bottom margins for the scrolling region.
@@ -338,7 +541,9 @@ class BetterScreen(object):
 
             self._original_screen = None
             self._original_screen_vars = {}
+            self._reflow_screen()  # (When resized in the alternate screen.)
             self._reset_offset_and_margins()
+            self.damage.add_all()
 
     @property
     def _in_alternate_screen(self):
@@ -371,6 +576,7 @@ class BetterScreen(object):
         # entered.
         if pt_screen.cursor_position.x >= self.columns:
             if mo.DECAWM in self.mode:
+                pt_screen.data_buffer[pt_screen.cursor_position.y].wrapped = True
                 self.carriage_return()
                 self.linefeed()
             else:
@@ -382,12 +588,13 @@ class BetterScreen(object):
         if mo.IRM in self.mode:
             self.insert_characters(char_width)
 
-        token = ('C', ) + self._attrs
+        style = self._style
         row = pt_screen.data_buffer[pt_screen.cursor_position.y]
-        row[pt_screen.cursor_position.x] = Char(char, token)
+        self.damage.lines.add(pt_screen.cursor_position.y)
+        row.set(pt_screen.cursor_position.x, char, style)
 
         if char_width > 1:
-            row[pt_screen.cursor_position.x + 1] = Char(' ', token)
+            row.set(pt_screen.cursor_position.x + 1, ' ', style)
 
         # .. note:: We can't use :meth:`cursor_forward()`, because that
         #           way, we'll never know when to linefeed.
@@ -395,6 +602,99 @@ class BetterScreen(object):
 
         self.max_y = max(self.max_y, pt_screen.cursor_position.y)
 
+    def draw_string(self, string):
+        """
+        Draw a run of printable characters. This does the same as calling
+        :meth:`draw` for every character, but much faster, because the
+        attributes, the current row and the cursor position are only looked
+        up once. (Most of the output of a process consists of such runs.)
+        """
+        # In insert mode, every character shifts the line. That's rare, so
+        # keep the slow path.
+        if mo.IRM in self.mode:
+            for char in string:
+                self.draw(char)
+            return
+
+        pt_screen = self.pt_screen
+        data_buffer = pt_screen.data_buffer
+        cursor_position = pt_screen.cursor_position
+        columns = self.columns
+        autowrap = mo.DECAWM in self.mode
+
+        # Translating the given characters.
+        if self.charset:
+            string = string.translate(self.g1_charset)
+        else:
+            string = string.translate(self.g0_charset)
+
+        style = self._style
+        row = data_buffer[cursor_position.y]
+        x = cursor_position.x
+
+        damaged_lines = self.damage.lines
+        damaged_lines.add(cursor_position.y)
+
+        match_ascii = _ascii_run_re.match
+        length = len(string)
+        i = 0
+
+        while i < length:
+            # Runs of ASCII characters take one cell per character. Write
+            # them in slices, up to the end of the line.
+            m = match_ascii(string, i) if autowrap else None
+
+            if m:
+                end = m.end()
+
+                while i < end:
+                    if x >= columns:
+                        row.wrapped = True
+                        cursor_position.x = x
+                        self.max_y = max(self.max_y, cursor_position.y)
+                        self.carriage_return()
+                        self.linefeed()
+                        row = data_buffer[cursor_position.y]
+                        x = cursor_position.x
+                        damaged_lines.add(cursor_position.y)
+
+                    count = min(end - i, columns - x)
+                    row.write(x, string[i:i + count], style)
+                    x += count
+                    i += count
+                continue
+
+            char = string[i]
+            char_width = get_cwidth(char)
+            i += 1
+
+            # Wrap at the end of the line. (See `draw`.)
+            if x >= columns:
+                if autowrap:
+                    row.wrapped = True
+                    cursor_position.x = x
+                    self.max_y = max(self.max_y, cursor_position.y)
+                    self.carriage_return()
+                    self.linefeed()
+                    row = data_buffer[cursor_position.y]
+                    x = cursor_position.x
+                    damaged_lines.add(cursor_position.y)
+                else:
+                    x -= char_width
+
+            row.set(x, char, style)
+
+            if char_width > 1:
+                row.set(x + 1, ' ', style)
+
+            x += char_width
+
+        cursor_position.x = x
+
+        # (When the cursor was below the screen, wrapping moves it up. So,
+        # the row is also recorded before every wrap.)
+        self.max_y = max(self.max_y, cursor_position.y)
+
     def carriage_return(self):
         " Move the cursor to the beginning of the current line. "
         self.pt_screen.cursor_position.x = 0
@@ -412,10 +712,8 @@ class BetterScreen(object):
             self.cursor_down()
         else:
             if self.pt_screen.cursor_position.y - self.line_offset == bottom:
-                for line in range(top, bottom):
-                    self.data_buffer[line + self.line_offset] = \
-                        self.data_buffer[line + self.line_offset + 1]
-                    del self.data_buffer[line + self.line_offset + 1]
+                self.data_buffer.scroll(top + self.line_offset, bottom + self.line_offset, 1)
+                self.damage.add_range(top + self.line_offset, bottom + self.line_offset)
             else:
                 self.cursor_down()
 
@@ -426,18 +724,42 @@ class BetterScreen(object):
         Remove top from the scroll buffer. (Outside bounds of history limit.)
         """
         remove_above = max(0, self.pt_screen.cursor_position.y - self.get_history_limit())
-        data_buffer = self.pt_screen.data_buffer
-        for line in list(data_buffer):
-            if line < remove_above:
-                del data_buffer[line]
+        self.pt_screen.data_buffer.remove_lines_before(remove_above)
+
+        # (Only when the history limit is smaller than the screen.)
+        if remove_above > self.line_offset:
+            self.damage.add_range(self.line_offset, remove_above)
+
+        # Pack the lines that are far enough above the visible area.
+        self.pt_screen.data_buffer.freeze_lines_before(
+            self.line_offset - self.get_history_hot_lines())
+
+        self.search_index.add_lines_before(self.line_offset)
 
     def clear_history(self):
         """
         Delete all history from the scroll buffer.
         """
-        for line in list(self.data_buffer):
-            if line < self.line_offset:
-                del self.data_buffer[line]
+        self.data_buffer.remove_lines_before(self.line_offset, spill=False)
+
+        if self.data_buffer.spill is not None:
+            self.data_buffer.spill.clear()
+
+        self.search_index.clear()
+        self._reflow_history_before = None
+
+    def close(self):
+        """
+        Release the resources of this screen: remove the file with the lines
+        that were removed from the history.
+        """
+        data_buffers = [self.data_buffer]
+        if self._in_alternate_screen:
+            data_buffers.append(self._original_screen_vars['data_buffer'])
+
+        for data_buffer in data_buffers:
+            if data_buffer is not None and data_buffer.spill is not None:
+                data_buffer.spill.close()
 
     def reverse_index(self):
         top, bottom = self.margins
@@ -445,9 +767,8 @@ class BetterScreen(object):
 
         # When scrolling over the full screen -> keep history.
         if self.pt_screen.cursor_position.y - line_offset == top:
-            for i in range(bottom - 1, top - 1, -1):
-                self.data_buffer[i + line_offset + 1] = self.data_buffer[i + line_offset]
-                del self.data_buffer[i + line_offset]
+            self.data_buffer.scroll(top + line_offset, bottom + line_offset, -1)
+            self.damage.add_range(top + line_offset, bottom + line_offset)
         else:
             self.cursor_up()
 
@@ -536,12 +857,8 @@ class BetterScreen(object):
 
         # If cursor is outside scrolling margins it -- do nothing.
         if top <= self.pt_screen.cursor_position.y - self.line_offset <= bottom:
-            for line in range(bottom, self.pt_screen.cursor_position.y - self.line_offset, -1):
-                if line - count < top:
-                    del self.data_buffer[line + self.line_offset]
-                else:
-                    self.data_buffer[line + self.line_offset] = self.data_buffer[line + self.line_offset - count]
-                    del self.data_buffer[line + self.line_offset - count]
+            self.data_buffer.scroll(self.pt_screen.cursor_position.y, bottom + self.line_offset, -count)
+            self.damage.add_range(self.pt_screen.cursor_position.y, bottom + self.line_offset)
 
             self.carriage_return()
 
@@ -558,15 +875,8 @@ class BetterScreen(object):
 
         # If cursor is outside scrolling margins it -- do nothin'.
         if top <= self.pt_screen.cursor_position.y - self.line_offset <= bottom:
-            # Iterate from the cursor Y position until the end of the visible input.
-            for line in range(self.pt_screen.cursor_position.y - self.line_offset, bottom + 1):
-
-                # When 'x' lines further are out of the margins, replace by an empty line,
-                # Otherwise copy the line from there.
-                if line + count > bottom:
-                    del self.data_buffer[line + self.line_offset]
-                else:
-                    self.data_buffer[line + self.line_offset] = self.data_buffer[line + count + self.line_offset]
+            self.data_buffer.scroll(self.pt_screen.cursor_position.y, bottom + self.line_offset, count)
+            self.damage.add_range(self.pt_screen.cursor_position.y, bottom + self.line_offset)
 
     def insert_characters(self, count=None):  # XXX: used by pressing space in bash vi mode
         """Inserts the indicated # of blank characters at the cursor
@@ -579,24 +889,15 @@ class BetterScreen(object):
         count = count or 1
 
         line = self.data_buffer[self.pt_screen.cursor_position.y]
-
-        if line:
-            max_columns = max(line.keys())
-
-            for i in range(max_columns, self.pt_screen.cursor_position.x - 1, -1):
-                line[i + count] = line[i]
-                del line[i]
+        line.insert_blanks(self.pt_screen.cursor_position.x, count)
+        self.damage.lines.add(self.pt_screen.cursor_position.y)
 
     def delete_characters(self, count=None):
         count = count or 1
 
         line = self.data_buffer[self.pt_screen.cursor_position.y]
-        if line:
-            max_columns = max(line.keys())
-
-            for i in range(self.pt_screen.cursor_position.x, max_columns + 1):
-                line[i] = line[i + count]
-                del line[i + count]
+        line.delete(self.pt_screen.cursor_position.x, count)
+        self.damage.lines.add(self.pt_screen.cursor_position.y)
 
     def cursor_position(self, line=None, column=None):
         """Set the cursor to a specific `line` and `column`.
@@ -691,8 +992,8 @@ class BetterScreen(object):
         self.ensure_bounds()
 
     def _set_char(self, x, y, data):
-        token = ('C', ) + self._attrs
-        self.pt_screen.data_buffer[y + self.line_offset][x] = Char(data, token)
+        self.pt_screen.data_buffer[y + self.line_offset].set(x, data, self._style)
+        self.damage.lines.add(y + self.line_offset)
 
     def erase_characters(self, count=None):
         """Erases the indicated # of characters, starting with the
@@ -711,10 +1012,11 @@ class BetterScreen(object):
         count = count or 1
         cursor_position = self.pt_screen.cursor_position
         row = self.data_buffer[cursor_position.y]
+        self.damage.lines.add(cursor_position.y)
 
         for column in range(cursor_position.x,
                             min(cursor_position.x + count, self.columns)):
-            row[column] = Char(token=row[column].token)
+            row.set(column, ' ', row.get_style(column))
 
     def erase_in_line(self, type_of=0, private=False):
         """Erases a line in a specific way.
@@ -729,21 +1031,20 @@ class BetterScreen(object):
         :param bool private: when ``True`` character attributes aren left
                              unchanged **not implemented**.
         """
+        self.damage.lines.add(self.pt_screen.cursor_position.y)
+
         if type_of == 2:
             # Delete line completely.
             del self.data_buffer[self.pt_screen.cursor_position.y]
         else:
             line = self.data_buffer[self.pt_screen.cursor_position.y]
+            x = self.pt_screen.cursor_position.x
 
-            def should_we_delete(column):  # TODO: check for off-by-one errors!
-                if type_of == 0:
-                    return column >= self.pt_screen.cursor_position.x
-                if type_of == 1:
-                    return column <= self.pt_screen.cursor_position.x
-
-            for column in list(line.keys()):
-                if should_we_delete(column):
-                    del line[column]
+            if type_of == 0:
+                line.truncate(x)
+                line.wrapped = False
+            elif type_of == 1:
+                line.erase(0, x + 1)
 
     def erase_in_display(self, type_of=0, private=False):
         """Erases display in a specific way.
@@ -762,8 +1063,10 @@ class BetterScreen(object):
         """
         if type_of == 3:
             # Clear data buffer.
-            for y in list(self.data_buffer):
-                del self.data_buffer[y]
+            self.data_buffer.clear()
+            self.search_index.clear()
+            self.damage.add_all()
+            self._reflow_history_before = None
 
             # Reset line_offset.
             self.pt_screen.cursor_position.y -= self.line_offset
@@ -784,7 +1087,10 @@ class BetterScreen(object):
                 return
 
             for line in interval:
-                self.data_buffer[line] = defaultdict(lambda: Char(' '))
+                self.data_buffer[line] = Row()
+
+            if interval:
+                self.damage.add_range(interval[0], interval[-1])
 
             # In case of 0 or 1 we have to erase the line with the cursor.
             if type_of in [0, 1]:
@@ -830,8 +1136,9 @@ class BetterScreen(object):
     def alignment_display(self):
         for y in range(0, self.lines):
             line = self.data_buffer[y + self.line_offset]
-            for x in range(0, self.columns):
-                line[x] = Char('E')
+            line.write(0, 'E' * self.columns, DEFAULT_STYLE)
+
+        self.damage.add_range(self.line_offset, self.line_offset + self.lines - 1)
 
     # Mapping of the ANSI color codes to their names.
     _fg_colors = dict((v, k) for k, v in FG_ANSI_COLORS.items())
@@ -0,0 +1,246 @@
+"""
+Search index for the history of a :class:`pymux.screen.BetterScreen`.
+
+The index maps every trigram (three consecutive characters, in lower case) to
+the blocks of lines where it appears. The lines are added when they scroll
+into the history, so the index is maintained incrementally: every line is
+read once. A search only reads the lines of the blocks that contain all the
+trigrams of the search string, and the lines that are not in the index yet
+(the visible area).
+"""
+from __future__ import unicode_literals
+from array import array
+from itertools import chain
+
+import bisect
+import re
+
+__all__ = (
+    'SearchIndex',
+    'get_line_text',
+)
+
+# Text that is the same in copy mode as in the row.
+_plain_text_re = re.compile('^[ -~]*$')
+
+
+def get_line_text(row, end=None):
+    """
+    Return the text of a :class:`pymux.storage.Row`, the way it appears in
+    copy mode: without the cells that are covered by double width
+    characters, and with control characters in their printable form.
+
+    :param end: Only the cells before this column.
+    """
+    text = row.chars.tounicode()
+
+    if end is None:
+        end = len(text)
+
+    if _plain_text_re.match(text):
+        return text[:end]
+
+    result = []
+    x = 0
+    while x < end:
+        c = row[x]
+        result.append(c.char)
+        x += 2 if c.width == 2 else 1
+
+    return ''.join(result)
+
+
+def _get_trigrams(text):
+    """
+    Set of all the (lower case) trigrams in this text, as tuples of three
+    characters. (Creating those with `zip` is much faster than slicing.)
+    """
+    text = text.lower()
+    return set(zip(text, text[1:], text[2:]))
+
+
+class SearchIndex(object):
+    """
+    Trigram index for the lines of a :class:`pymux.storage.DataBuffer`.
+
+    :param block_size: Number of lines in one block of the index. Bigger
+        blocks make the index smaller, but more lines have to be read for
+        every block that matches.
+    :param batch_size: Lines are only added to the index when at least this
+        many lines are waiting.
+    """
+    def __init__(self, data_buffer, block_size=256, batch_size=64):
+        assert isinstance(block_size, int) and block_size > 0
+        assert isinstance(batch_size, int) and batch_size > 0
+
+        self.data_buffer = data_buffer
+        self.block_size = block_size
+        self.batch_size = batch_size
+        self.clear()
+
+    def clear(self):
+        " Remove everything from the index. "
+        self._postings = {}  # Maps trigrams to an array of block numbers.
+        self._start = None  # First line in the index.
+        self._end = None  # Line number after the last line in the index.
+        self._first_block = 0  # Blocks before this one were pruned.
+
+    def add_lines_before(self, y):
+        """
+        Add the lines until line number `y` to the index. (Called when lines
+        scroll into the history.)
+        """
+        if self._end is None:
+            self._start = self._end = self.data_buffer.first_line
+
+        # The lines after `y` became visible again. (After a resize.) They can
+        # change, so remove them from the index.
+        if y < self._end:
+            self._truncate(max(y, self._start))
+
+        if y - self._end >= self.batch_size:
+            self._prune()
+            self._index(max(self._end, self.data_buffer.first_line), y)
+            self._end = y
+
+    def _index(self, start, end):
+        " Add the lines from `start` until `end` to the index. "
+        get_line = self.data_buffer.get_line
+        block_size = self.block_size
+        postings = self._postings
+
+        for block_start in range(start - start % block_size, end, block_size):
+            block = block_start // block_size
+
+            # (The trigrams that span two lines are harmless.)
+            trigrams = _get_trigrams('\n'.join(
+                get_line_text(get_line(y))
+                for y in range(max(start, block_start), min(end, block_start + block_size))))
+
+            for trigram in trigrams:
+                blocks = postings.get(trigram)
+
+                if blocks is None:
+                    postings[trigram] = array('I', [block])
+                elif blocks[-1] != block:
+                    blocks.append(block)
+
+    def _truncate(self, y):
+        " Remove the lines from line number `y` from the index. "
+        block = y // self.block_size
+
+        for trigram, blocks in list(self._postings.items()):
+            del blocks[bisect.bisect_left(blocks, block):]
+            if not blocks:
+                del self._postings[trigram]
+
+        # Index the first lines of that block again.
+        self._end = max(self._start, block * self.block_size)
+        if self._end < y:
+            self._index(self._end, y)
+            self._end = y
+
+    def _prune(self):
+        """
+        Remove the blocks that were removed from the history. (Only once in
+        a while, because this goes through the whole index.)
+        """
+        first_block = self.data_buffer.first_line // self.block_size
+
+        if first_block - self._first_block >= 64:
+            for trigram, blocks in list(self._postings.items()):
+                del blocks[:bisect.bisect_left(blocks, first_block)]
+                if not blocks:
+                    del self._postings[trigram]
+
+            self._first_block = first_block
+
+    def _get_candidate_blocks(self, text):
+        """
+        Return the sorted list of blocks that contain all the trigrams of
+        `text`, or `None` when the text is too short to use the index.
+        """
+        trigrams = _get_trigrams(text)
+
+        if not trigrams:
+            return None
+
+        postings = sorted((self._postings.get(t, ()) for t in trigrams), key=len)
+        result = set(postings[0])
+
+        for blocks in postings[1:]:
+            if not result:
+                break
+            result.intersection_update(blocks)
+
+        return sorted(result)
+
+    def can_search(self, text):
+        " True when the index can be used for finding this text. "
+        return bool(_get_trigrams(text))
+
+    def get_candidate_ranges(self, text, start=0, end=None, reverse=False):
+        """
+        Return a list of (start, end) tuples: the ranges of lines between
+        `start` and `end` (not included) that can contain `text`. These are
+        the matching blocks in the index, and the lines that are not in the
+        index. In ascending order, or descending when `reverse` is `True`.
+
+        :param end: `None` for the end of the data buffer.
+        """
+        start = max(start, self.data_buffer.first_line)
+
+        if end is None:
+            lines = self.data_buffer.keys()
+            end = lines[-1] + 1 if lines else start
+
+        if self._end is None:
+            indexed_start = indexed_end = start
+        else:
+            indexed_start = max(start, self._start)
+            indexed_end = max(indexed_start, min(end, self._end))
+
+        # Line ranges to read: the candidates from the index, followed by the
+        # lines that are not in the index.
+        blocks = self._get_candidate_blocks(text)
+        block_size = self.block_size
+
+        if blocks is None:
+            ranges = [(indexed_start, indexed_end)]
+        else:
+            ranges = [(max(indexed_start, b * block_size), min(indexed_end, (b + 1) * block_size))
+                      for b in blocks]
+
+        ranges.append((max(start, indexed_end), end))
+        ranges = [r for r in ranges if r[0] < r[1]]
+
+        if reverse:
+            ranges.reverse()
+
+        return ranges
+
+    def find_lines(self, text, start=0, end=None, reverse=False, ignore_case=False):
+        """
+        Yield the numbers of the lines between `start` and `end` (not
+        included) that contain `text`. Ascending, or descending when
+        `reverse` is `True`. (See :meth:`get_candidate_ranges`.)
+        """
+        ranges = self.get_candidate_ranges(text, start, end, reverse=reverse)
+
+        if reverse:
+            lines = chain.from_iterable(reversed(range(*r)) for r in ranges)
+        else:
+            lines = chain.from_iterable(range(*r) for r in ranges)
+
+        get_line = self.data_buffer.get_line
+
+        if ignore_case:
+            text = text.lower()
+
+            for y in lines:
+                if text in get_line_text(get_line(y)).lower():
+                    yield y
+        else:
+            for y in lines:
+                if text in get_line_text(get_line(y)):
+                    yield y
@@ -72,11 +72,15 @@ class ServerConnection(object):
         elif packet['cmd'] == 'flush-input':
             self._inputstream.flush()  # Flush escape key.
 
-        # Set size. (The client reports the size.)
+        # Set size. (The client reports the size.) Only redraw when it
+        # changed.
         elif packet['cmd'] == 'size':
             data = packet['data']
-            self.size = Size(rows=data[0], columns=data[1])
-            self.pymux.invalidate()
+            size = Size(rows=data[0], columns=data[1])
+
+            if size != self.size:
+                self.size = size
+                self.pymux.invalidate()
 
         # Start GUI. (Create CommandLineInterface front-end for pymux.)
         elif packet['cmd'] == 'start-gui':
@@ -0,0 +1,108 @@
+"""
+Pool of pre-started shells.
+
+Starting an interactive login shell can take a noticeable amount of time
+before the prompt appears. When the "shell-pool-size" option is set, we keep a
+couple of shells running off-screen, so that `split-window` and `new-window`
+can adopt one that is already interactive.
+"""
+from __future__ import unicode_literals
+import signal
+
+from .log import logger
+from .process import ExecError
+
+__all__ = (
+    'ShellPool',
+)
+
+
+class ShellPool(object):
+    """
+    Keeps warm :class:`pymux.arrangement.Pane` instances for one key.
+
+    The key is a (shell, cwd, ...) tuple. The remaining items are other
+    settings that are fixed at the moment the process starts, like the
+    terminal type. A pooled pane is only handed out for exactly the same key.
+    Only the shells for the latest key are kept. (When a new pane starts in
+    another directory, the shells for the previous one are discarded.)
+
+    :param create_pane: Callable that takes a key and returns a new, started
+        pane for that key. It can raise :class:`pymux.process.ExecError`.
+    """
+    def __init__(self, create_pane):
+        assert callable(create_pane)
+
+        self.create_pane = create_pane
+        self._key = None
+        self._panes = []
+
+    def __len__(self):
+        return len(self._panes)
+
+    def __contains__(self, pane):
+        return pane in self._panes
+
+    def take(self, key):
+        """
+        Remove a running pane for this key from the pool and return it, or
+        return `None` when there is nothing available.
+        """
+        if key == self._key:
+            while self._panes:
+                pane = self._panes.pop(0)
+                if not pane.process.is_terminated:
+                    return pane
+
+    def remove(self, pane):
+        """
+        Forget about this pane. (Called when a pooled process terminates.)
+        Return `True` when the pane was part of the pool.
+        """
+        if pane in self._panes:
+            self._panes.remove(pane)
+            return True
+        return False
+
+    def needs_refill(self, key, size):
+        """
+        True when `refill` would start or discard shells.
+        """
+        return key != self._key or len(self._panes) != size
+
+    def refill(self, key, size):
+        """
+        Start shells until there are `size` running panes for this key. The
+        shells for another key are discarded.
+        """
+        assert isinstance(size, int)
+
+        if key != self._key:
+            self.clear()
+            self._key = key
+
+        while len(self._panes) > size:
+            self._kill(self._panes.pop())
+
+        while len(self._panes) < size:
+            try:
+                self._panes.append(self.create_pane(key))
+            except ExecError as e:
+                logger.info('Could not fill shell pool: %s', e.message)
+                break
+
+    def clear(self):
+        """
+        Kill all pooled shells. (For instance when the environment changed,
+        and new shells should pick that up.)
+        """
+        for pane in self._panes:
+            self._kill(pane)
+
+        self._key = None
+        self._panes = []
+
+    def _kill(self, pane):
+        " Kill the process of this pane. "
+        if not pane.process.is_terminated:
+            pane.process.send_signal(signal.SIGKILL)
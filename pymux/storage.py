@@ -0,0 +1,835 @@
+"""
+Compact storage for the content of a :class:`pymux.screen.BetterScreen`.
+
+Instead of a `Char` instance for every cell, a row stores its characters in an
+`array('u')` and the style of every cell, as an interned integer, in a
+parallel `array('I')`. The renderer still sees a mapping of rows, and every
+row is a mapping from column to `Char`, like the `data_buffer` of a
+prompt_toolkit `Screen`. The `Char` instances are created when they are read.
+
+Lines of the history that are far enough above the visible area are packed
+in blocks (text and styles, serialized with `marshal` and compressed with
+`zlib`). They are unpacked again when they are needed.
+
+Lines that are removed from the history can be written to a `SpillFile`: a
+temporary file on disk that is read back through a memory map.
+
+A row that was continued on the next line by auto wrap has its `wrapped`
+flag set. :func:`rewrap_rows` uses that to wrap the lines again for another
+number of columns.
+"""
+from __future__ import unicode_literals
+from array import array
+
+from prompt_toolkit.layout.screen import Char
+from prompt_toolkit.styles import Attrs
+from prompt_toolkit.utils import get_cwidth
+from pygments.token import Token
+
+import bisect
+import marshal
+import mmap
+import re
+import six
+import tempfile
+import zlib
+
+__all__ = (
+    'CharCache',
+    'DEFAULT_STYLE',
+    'DEFAULT_TOKEN',
+    'DataBuffer',
+    'Row',
+    'SpillFile',
+    'get_token',
+    'intern_token',
+    'rewrap_rows',
+)
+
+DEFAULT_TOKEN = ('C', ) + Attrs(color=None, bgcolor=None, bold=False, underline=False,
+                                italic=False, blink=False, reverse=False)
+
+#: Style ID of the default style.
+DEFAULT_STYLE = 0
+
+# Process wide style intern table. Maps tokens to style IDs and back.
+# (`Token` and `DEFAULT_TOKEN` render the same, they share ID 0.)
+_token_to_style = {DEFAULT_TOKEN: DEFAULT_STYLE, Token: DEFAULT_STYLE}
+_style_to_token = [DEFAULT_TOKEN]
+
+
+def intern_token(token):
+    """
+    Return the style ID for this token.
+    """
+    try:
+        return _token_to_style[token]
+    except KeyError:
+        style = len(_style_to_token)
+        _style_to_token.append(token)
+        _token_to_style[token] = style
+        return style
+
+
+def get_token(style):
+    """
+    Return the token for this style ID.
+    """
+    return _style_to_token[style]
+
+
+# `Char` replaces control characters by a printable representation (like
+# '^A'). Map those back, when a `Char` is stored.
+_display_mappings_reversed = dict((v, k) for k, v in Char.display_mappings.items())
+
+
+class CharCache(object):
+    """
+    Bounded cache of `Char` instances, so that identical cells share one
+    `Char`. (`Char` instances are never modified.) The cache is cleared when
+    it's full.
+
+    :param create_char: Callable that creates the `Char` for a key.
+    :param size: Maximum number of entries.
+    """
+    def __init__(self, create_char, size=20000):
+        assert callable(create_char)
+        assert isinstance(size, int) and size > 0
+
+        self.create_char = create_char
+        self.size = size
+        self._cache = {}
+
+    def __len__(self):
+        return len(self._cache)
+
+    def clear(self):
+        self._cache = {}
+
+    def get(self, key):
+        """
+        Return the `Char` for this key.
+        """
+        try:
+            return self._cache[key]
+        except KeyError:
+            if len(self._cache) >= self.size:
+                self._cache.clear()
+
+            char = self._cache[key] = self.create_char(key)
+            return char
+
+
+# The `Char` instances that are handed out by `Row.__getitem__`, for
+# (character, style) tuples.
+_char_cache = CharCache(lambda key: Char(key[0], _style_to_token[key[1]]))
+
+_default_char = Char(' ', DEFAULT_TOKEN)
+
+
+class Row(object):
+    """
+    One row of the screen.
+
+    The row has a length: the cells after the last written cell are blank.
+    Reading those returns a space in the default style. (Unlike a
+    `defaultdict`, reading does not make the row longer.)
+
+    `wrapped` is `True` when the text continues on the next row, because it
+    was wrapped at the end of this one. (A soft line break.)
+    """
+    __slots__ = ('chars', 'styles', 'wrapped')
+
+    def __init__(self):
+        self.chars = array('u')
+        self.styles = array('I')
+        self.wrapped = False
+
+    def __len__(self):
+        return len(self.chars)
+
+    def __iter__(self):
+        return iter(range(len(self.chars)))
+
+    def __contains__(self, x):
+        return 0 <= x < len(self.chars)
+
+    def keys(self):
+        return range(len(self.chars))
+
+    def __getitem__(self, x):
+        if 0 <= x < len(self.chars):
+            return _char_cache.get((self.chars[x], self.styles[x]))
+        else:
+            return _default_char
+
+    def __setitem__(self, x, char):
+        " Store a `Char` instance. "
+        c = char.char
+        self.set(x, _display_mappings_reversed.get(c, c), intern_token(char.token))
+
+    def __delitem__(self, x):
+        " Erase this cell. "
+        length = len(self.chars)
+
+        if x == length - 1:
+            self.chars.pop()
+            self.styles.pop()
+        elif 0 <= x < length:
+            self.chars[x] = ' '
+            self.styles[x] = DEFAULT_STYLE
+
+    def _extend(self, length):
+        " Pad the row with blank cells, up to this length. "
+        missing = length - len(self.chars)
+
+        if missing > 0:
+            self.chars.fromunicode(' ' * missing)
+            self.styles.extend(array('I', [DEFAULT_STYLE]) * missing)
+
+    def set(self, x, char, style):
+        """
+        Store a single character with the given style ID.
+        """
+        if x < len(self.chars):
+            self.chars[x] = char
+            self.styles[x] = style
+        else:
+            self._extend(x)
+            self.chars.append(char)
+            self.styles.append(style)
+
+    def write(self, x, text, style):
+        """
+        Store a string of characters, starting at column `x`, all in the same
+        style. Every character is expected to take one cell.
+        """
+        end = x + len(text)
+
+        self._extend(x)
+        self.chars[x:end] = array('u', text)
+        self.styles[x:end] = array('I', [style]) * len(text)
+
+    def get_style(self, x):
+        " Return the style ID of this cell. "
+        if 0 <= x < len(self.styles):
+            return self.styles[x]
+        else:
+            return DEFAULT_STYLE
+
+    def insert_blanks(self, x, count):
+        """
+        Insert `count` blank cells at column `x`, shifting the rest of the row
+        to the right. (Nothing happens when `x` is after the end of the row.)
+        """
+        if x < len(self.chars):
+            self.chars[x:x] = array('u', ' ' * count)
+            self.styles[x:x] = array('I', [DEFAULT_STYLE]) * count
+
+    def delete(self, x, count):
+        """
+        Delete `count` cells at column `x`, shifting the rest of the row to
+        the left.
+        """
+        del self.chars[x:x + count]
+        del self.styles[x:x + count]
+
+    def truncate(self, length):
+        " Erase everything from this column until the end of the row. "
+        del self.chars[length:]
+        del self.styles[length:]
+
+    def erase(self, start, end):
+        " Erase the cells in the range [start, end). "
+        end = min(end, len(self.chars))
+
+        if start < end:
+            self.chars[start:end] = array('u', ' ' * (end - start))
+            self.styles[start:end] = array('I', [DEFAULT_STYLE]) * (end - start)
+
+
+if six.PY2:
+    def _array_to_bytes(a):
+        return a.tostring()
+
+    def _array_from_bytes(a, data):
+        a.fromstring(data)
+else:
+    def _array_to_bytes(a):
+        return a.tobytes()
+
+    def _array_from_bytes(a, data):
+        a.frombytes(data)
+
+
+def _pack_row(row):
+    """
+    Turn a row into a (text, styles, wrapped) tuple. `styles` is one style ID
+    when all the cells have the same style (that's the common case),
+    otherwise the bytes of the array.
+    """
+    styles = row.styles
+
+    if not styles:
+        style = DEFAULT_STYLE
+    elif styles.count(styles[0]) == len(styles):
+        style = styles[0]
+    else:
+        style = _array_to_bytes(styles)
+
+    return row.chars.tounicode(), style, row.wrapped
+
+
+def _unpack_row(text, style, wrapped=False):
+    " Create a row from the result of `_pack_row`. "
+    row = Row()
+    row.chars.fromunicode(text)
+    row.wrapped = wrapped
+
+    if isinstance(style, six.integer_types):
+        row.styles = array('I', [style]) * len(text)
+    else:
+        _array_from_bytes(row.styles, style)
+
+    return row
+
+
+# Text in which every character takes one cell.
+_single_width_re = re.compile('^[ -~]*$')
+
+
+def _get_breaks(text, columns):
+    """
+    Return the index of the first cell of every row, when this text is
+    wrapped at `columns` columns. A double width character (followed by its
+    blank second cell) is never split over two rows.
+    """
+    if _single_width_re.match(text):
+        return list(range(0, len(text), columns)) or [0]
+
+    breaks = [0]
+    x = i = 0
+
+    while i < len(text):
+        width = 2 if get_cwidth(text[i]) == 2 else 1
+
+        if x and x + width > columns:
+            breaks.append(i)
+            x = 0
+
+        x += width
+        i += width
+
+    return breaks
+
+
+def rewrap_rows(rows, columns, positions=()):
+    """
+    Wrap the text of these consecutive rows again, for a screen with
+    `columns` columns. Rows that are joined by their `wrapped` flag are one
+    logical line. Trailing blanks at the end of a logical line are removed.
+    (When the last row is wrapped, its logical line continues after these
+    rows, and is kept like that.)
+
+    :param positions: List of (index in `rows`, x) tuples, like the cursor
+        position, that have to be translated.
+    :returns: (new rows, translated positions) tuple.
+    """
+    assert columns > 0
+
+    result = []
+    result_positions = list(positions)
+    i = 0
+
+    while i < len(rows):
+        # Find the rows of this logical line.
+        j = i
+        while j < len(rows) - 1 and rows[j].wrapped:
+            j += 1
+
+        chars = array('u')
+        styles = array('I')
+        starts = []  # Cell of the logical line where every row starts.
+
+        for row in rows[i:j + 1]:
+            starts.append(len(chars))
+            chars.extend(row.chars)
+            styles.extend(row.styles)
+
+        wrapped = rows[j].wrapped
+
+        if not wrapped:
+            end = len(chars)
+            while end and chars[end - 1] == ' ' and styles[end - 1] == DEFAULT_STYLE:
+                end -= 1
+            del chars[end:]
+            del styles[end:]
+
+        breaks = _get_breaks(chars.tounicode(), columns)
+
+        for k, start in enumerate(breaks):
+            end = breaks[k + 1] if k + 1 < len(breaks) else len(chars)
+
+            row = Row()
+            row.chars = chars[start:end]
+            row.styles = styles[start:end]
+            row.wrapped = k + 1 < len(breaks) or wrapped
+            result.append(row)
+
+        # Translate the positions in this logical line.
+        for n, (index, x) in enumerate(positions):
+            if i <= index <= j:
+                cell = starts[index - i] + x
+                k = bisect.bisect_right(breaks, cell) - 1
+                result_positions[n] = (len(result) - len(breaks) + k,
+                                       min(columns, cell - breaks[k]))
+
+        i = j + 1
+
+    return result, result_positions
+
+
+class SpillFile(object):
+    """
+    Storage on disk for the lines that are removed from a `DataBuffer`, so
+    that the history stays available (for copy mode and search) while the
+    memory usage is bounded.
+
+    The lines are appended in blocks of `block_size` lines, packed like the
+    blocks of the `DataBuffer`. The offset of every block in the file is kept
+    in an index, and the file is read through a memory map. The last lines,
+    that don't make a complete block yet, stay in memory.
+
+    The file is an anonymous temporary file: it is removed from the file
+    system right away, and its space is released by :meth:`close` or when
+    the process exits.
+
+    :param directory: Directory for the temporary file. (`None` for the
+        default of the `tempfile` module.)
+    """
+    def __init__(self, block_size=256, directory=None):
+        assert isinstance(block_size, int) and block_size > 0
+
+        self.block_size = block_size
+        self.directory = directory
+
+        self._file = None
+        self._mmap = None
+        self._offsets = array('L', [0])  # Start of every block, and end of the last one.
+        self._first = 0  # Line number of the first line.
+        self._count = 0  # Number of lines in the file, and in `_pending`.
+        self._pending = []  # Packed lines, not yet written.
+        self._read_cache = (None, None)  # (block number, unpacked block).
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def first_line(self):
+        " Line number of the first line. "
+        return self._first
+
+    @property
+    def end_line(self):
+        " Line number after the last line. "
+        return self._first + self._count
+
+    def __contains__(self, y):
+        return self._first <= y < self._first + self._count
+
+    def append(self, y, row):
+        """
+        Add the row for line `y` at the end. Lines that are already in the
+        file are ignored. When lines are skipped, empty lines are added.
+        """
+        if not self._count:
+            self._first = y
+        elif y < self.end_line:
+            return
+
+        for _ in range(y - self.end_line):
+            self._add(('', DEFAULT_STYLE))
+        self._add(_pack_row(row))
+
+    def _add(self, line):
+        self._pending.append(line)
+        self._count += 1
+
+        if len(self._pending) == self.block_size:
+            self._write_block()
+
+    def _write_block(self):
+        " Write the pending lines to the file. "
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix='pymux-history-', dir=self.directory)
+
+        data = zlib.compress(marshal.dumps(self._pending), 1)
+        self._file.seek(self._offsets[-1])
+        self._file.write(data)
+        self._file.flush()
+
+        self._offsets.append(self._offsets[-1] + len(data))
+        self._pending = []
+
+    def get_line(self, y):
+        """
+        Return the row for line `y`, or `None` when it's not in the file.
+        """
+        if y not in self:
+            return None
+
+        block, index = divmod(y - self._first, self.block_size)
+
+        if block == len(self._offsets) - 1:
+            return _unpack_row(*self._pending[index])
+
+        if self._read_cache[0] != block:
+            self._read_cache = (block, self._read_block(block))
+
+        return _unpack_row(*self._read_cache[1][index])
+
+    def _read_block(self, block):
+        start, end = self._offsets[block], self._offsets[block + 1]
+
+        # Map the file again when it has grown since the last time.
+        if self._mmap is None or len(self._mmap) < end:
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return marshal.loads(zlib.decompress(self._mmap[start:end]))
+
+    def clear(self):
+        " Remove all lines, and release the file. "
+        self.close()
+        self._offsets = array('L', [0])
+        self._first = 0
+        self._count = 0
+        self._pending = []
+
+    def close(self):
+        " Close and remove the file. "
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        self._read_cache = (None, None)
+
+
+class DataBuffer(object):
+    """
+    The lines of a screen, including the scrollback, addressed by line number,
+    like a `defaultdict` of :class:`.Row` instances: reading a line that
+    doesn't exist creates it.
+
+    The lines are kept in a list, in order. Removing the oldest lines only
+    moves the start of the list forward. The list itself is shortened when
+    more than half of it is unused. So, appending a line at the bottom and
+    dropping one at the top (what happens for every new line when the
+    history is full) takes constant time, whatever the size of the history.
+
+    Old lines can be packed with :meth:`freeze_lines_before`. They are kept
+    in blocks of `block_size` lines (the block number is the line number
+    divided by the block size), and their place in the list is `None`.
+    Reading a packed line through `__getitem__` unpacks the whole block again,
+    :meth:`get_line` only reads it.
+
+    When a :class:`.SpillFile` is given, the lines that are removed from the
+    top are written to it, and :meth:`get_line` reads them back from there.
+
+    :param compress: Compress the packed blocks with zlib.
+    :param spill: `SpillFile` instance or `None`.
+    """
+    def __init__(self, block_size=64, compress=True, spill=None):
+        assert isinstance(block_size, int) and block_size > 0
+        assert spill is None or isinstance(spill, SpillFile)
+
+        self.block_size = block_size
+        self.compress = compress
+        self.spill = spill
+
+        self._rows = []
+        self._start = 0  # Index of the first line in `_rows`.
+        self._first = 0  # Line number of the first line.
+
+        self._frozen = {}  # Maps block numbers to packed blocks.
+        self._thawed = set()  # Blocks that were packed, but unpacked again.
+        self._next_block = 0  # The first block that was never packed.
+        self._read_cache = (None, None)  # (block number, unpacked block) for `get_line`.
+
+    def __len__(self):
+        return len(self._rows) - self._start
+
+    def __iter__(self):
+        return iter(range(self._first, self._first + len(self)))
+
+    def keys(self):
+        return range(self._first, self._first + len(self))
+
+    def __contains__(self, y):
+        return self._first <= y < self._first + len(self)
+
+    @property
+    def first_line(self):
+        """
+        Line number of the first line that :meth:`get_line` can return,
+        including the lines in the spill file.
+        """
+        if self.spill is not None and len(self.spill):
+            return min(self._first, self.spill.first_line)
+        return self._first
+
+    def __getitem__(self, y):
+        i = y - self._first + self._start
+
+        if not self._start <= i < len(self._rows):
+            i = self._create(y)
+
+        row = self._rows[i]
+
+        if row is None:
+            self._thaw(y // self.block_size)
+            row = self._rows[i]
+
+        return row
+
+    def __setitem__(self, y, row):
+        i = y - self._first + self._start
+
+        if not self._start <= i < len(self._rows):
+            i = self._create(y)
+
+        if self._rows[i] is None:
+            self._thaw(y // self.block_size)
+
+        self._rows[i] = row
+
+    def __delitem__(self, y):
+        " Erase this line. "
+        if y in self:
+            self[y] = Row()
+
+    def get_line(self, y):
+        """
+        Return the row for line `y`, without unpacking its block in the
+        buffer, and without creating the line when it doesn't exist. The
+        result should not be modified.
+        """
+        if y not in self:
+            if self.spill is not None and y < self._first:
+                row = self.spill.get_line(y)
+                if row is not None:
+                    return row
+            return Row()
+
+        row = self._rows[y - self._first + self._start]
+
+        if row is None:
+            block = y // self.block_size
+
+            if self._read_cache[0] != block:
+                self._read_cache = (block, self._unpack(self._frozen[block]))
+
+            first, lines = self._read_cache[1]
+            row = _unpack_row(*lines[y - first])
+
+        return row
+
+    def _create(self, y):
+        """
+        Create empty lines, so that line `y` exists. Return the index of `y`
+        in `_rows`.
+        """
+        if not len(self):
+            self._reset()
+            self._rows = [Row()]
+            self._first = y
+
+        elif y < self._first:
+            # Before the first line. (Rare, only when the cursor moves up into
+            # lines that were removed from the history.) Reuse the unused
+            # space at the start of the list.
+            count = self._first - y
+            reused = min(count, self._start)
+
+            for i in range(self._start - reused, self._start):
+                self._rows[i] = Row()
+
+            self._start -= reused
+            self._rows[self._start:self._start] = [Row() for _ in range(count - reused)]
+            self._first = y
+
+        else:
+            self._rows.extend(Row() for _ in range(y - self._first + self._start -
+                                                   len(self._rows) + 1))
+
+        return y - self._first + self._start
+
+    def scroll(self, top, bottom, count):
+        """
+        Move the lines from `top` until `bottom` (inclusive) up by `count`
+        lines, or down when `count` is negative. Lines that are moved out of
+        this range are lost, the lines that come in are empty.
+
+        (This only moves references to rows around. The rows themselves are
+        not copied.)
+        """
+        if top > bottom or not count:
+            return
+
+        self[top]
+        self[bottom]  # Make sure that all the lines exist.
+
+        if self._frozen:
+            for block in range(top // self.block_size, bottom // self.block_size + 1):
+                if block in self._frozen:
+                    self._thaw(block)
+
+        rows = self._rows
+        i = top - self._first + self._start
+        j = bottom - self._first + self._start + 1
+        count = max(i - j, min(j - i, count))
+
+        if count > 0:
+            rows[i:j] = rows[i + count:j] + [Row() for _ in range(count)]
+        else:
+            rows[i:j] = [Row() for _ in range(-count)] + rows[i:j + count]
+
+    def replace_lines(self, start, end, rows):
+        """
+        Replace the lines from `start` until `end` (exclusive) by the given
+        rows. The number of rows can be different: the lines after `end` move
+        up or down. (Used when the lines are wrapped again.)
+        """
+        self[start]
+        self[end - 1]  # Make sure that all the lines exist.
+
+        # The lines in the blocks after `start` get other numbers. Unpack
+        # those blocks; they are packed again by `freeze_lines_before`.
+        first_block = start // self.block_size
+
+        for block in [b for b in self._frozen if b >= first_block]:
+            self._thaw(block)
+
+        self._thawed = set(b for b in self._thawed if b < first_block)
+        self._next_block = min(self._next_block, first_block)
+        self._read_cache = (None, None)
+
+        i = start - self._first + self._start
+        self._rows[i:i + end - start] = rows
+
+    def remove_lines_before(self, y, spill=True):
+        """
+        Remove all the lines before line number `y` from the top.
+
+        :param spill: Write the removed lines to the spill file (if there is
+            one).
+        """
+        count = min(y - self._first, len(self))
+
+        if count > 0:
+            rows = self._rows
+            start = self._start
+            first_block = self._first // self.block_size
+
+            if spill and self.spill is not None:
+                for line in range(self._first, self._first + count):
+                    self.spill.append(line, self.get_line(line))
+
+            for i in range(start, start + count):
+                rows[i] = None
+            self._start = start + count
+            self._first += count
+
+            # Forget the packed blocks that were removed completely.
+            if self._frozen or self._thawed:
+                for block in range(first_block, self._first // self.block_size):
+                    self._frozen.pop(block, None)
+                    self._thawed.discard(block)
+                self._read_cache = (None, None)
+
+            # Release the unused part of the list.
+            if self._start > len(rows) // 2:
+                del rows[:self._start]
+                self._start = 0
+
+    def freeze_lines_before(self, y):
+        """
+        Pack all the blocks that are completely before line number `y`.
+        (Called for every new line, but usually there's nothing to do.)
+        """
+        end_block = y // self.block_size
+
+        # Blocks that were unpacked again, because they were accessed.
+        if self._thawed:
+            for block in [b for b in self._thawed if b < end_block]:
+                self._freeze(block)
+
+        self._next_block = max(self._next_block, self._first // self.block_size)
+
+        while self._next_block < end_block:
+            self._freeze(self._next_block)
+            self._next_block += 1
+
+    def _freeze(self, block):
+        " Pack the lines of this block. "
+        self._thawed.discard(block)
+
+        if block in self._frozen:
+            return
+
+        first = max(block * self.block_size, self._first)
+        last = min((block + 1) * self.block_size, self._first + len(self))
+
+        if first < last:
+            i = first - self._first + self._start
+            j = last - self._first + self._start
+            rows = self._rows
+
+            data = marshal.dumps((first, [_pack_row(row) for row in rows[i:j]]))
+            if self.compress:
+                data = zlib.compress(data, 1)
+
+            self._frozen[block] = data
+            rows[i:j] = [None] * (j - i)
+
+            if self._read_cache[0] == block:
+                self._read_cache = (None, None)
+
+    def _thaw(self, block):
+        " Unpack the lines of this block in the buffer again. "
+        first, lines = self._unpack(self._frozen.pop(block))
+
+        for y, line in enumerate(lines, first):
+            if y in self:
+                i = y - self._first + self._start
+                if self._rows[i] is None:
+                    self._rows[i] = _unpack_row(*line)
+
+        self._thawed.add(block)
+
+    def _unpack(self, data):
+        " Return the (first line number, lines) tuple of a packed block. "
+        if self.compress:
+            data = zlib.decompress(data)
+        return marshal.loads(data)
+
+    def clear(self):
+        " Remove all lines, including the lines in the spill file. "
+        self._reset()
+
+        if self.spill is not None:
+            self.spill.clear()
+
+    def _reset(self):
+        self._rows = []
+        self._start = 0
+        self._first = 0
+        self._frozen = {}
+        self._thawed = set()
+        self._next_block = 0
+        self._read_cache = (None, None)
@@ -2,18 +2,50 @@
 Improvements on Pyte.
 """
 from __future__ import unicode_literals
+from pyte import control as ctrl
 from pyte.streams import Stream
 from pyte.escape import NEL
 
+import re
+import six
+
 __all__ = (
     'BetterStream',
+    'TokenizingStream',
+    'STREAM_CLASSES',
 )
 
+# Characters that can't be part of a run of text. Everything else is drawn by
+# `Stream._stream`.
+_SPECIAL_CHARS = ''.join(Stream.basic) + ctrl.ESC + ctrl.CSI + ctrl.NUL + ctrl.DEL
+
+_printable_run_re = re.compile('[^%s]+' % re.escape(_SPECIAL_CHARS))
+
+# Tokens that `TokenizingStream` handles without the state machine. Only the
+# well formed variants are matched here, everything else (unknown sequences,
+# sequences with embedded control characters, or sequences that are split
+# across two `feed` calls) is passed to the state machine.
+_token_re = re.compile(
+    '(?P<text>[^%s]+)'
+    '|(?P<csi>(?:\\x1b\\[|\\x9b)(?P<csi_prefix>[?>]*)(?P<csi_params>[0-9;]*)(?P<csi_final>[@-~]))'
+    '|(?P<osc>\\x1b\\](?P<osc_data>[^\\x07\\x1b]*)(?:\\x07|\\x1b\\\\))'
+    '|(?P<esc>\\x1b(?P<esc_final>[^\\[\\]#%%()]))'
+    '|(?P<control>[%s])'
+    '|(?P<ignore>[\\x00\\x7f])' % (re.escape(_SPECIAL_CHARS), re.escape(''.join(Stream.basic))))
+
+
+# End of an OSC string: BEL, or the escape character of ST ("Esc\\").
+_osc_end_re = re.compile('[\x07\x1b]')
+
 
 class BetterStream(Stream):
     """
     Extension to the Pyte `Stream` class that also handles "Esc]<num>...BEL"
     sequences. This is used by xterm to set the terminal title.
+
+    :param max_osc_length: Maximum length of the payload of an OSC
+        ("Esc]...") sequence. Longer payloads (for instance when a binary file
+        is printed) are discarded, without keeping them in memory.
     """
     csi = {
         'n': 'cpr',  # Cursor position request.
@@ -29,14 +61,90 @@ class BetterStream(Stream):
         NEL: "next_line",
     })
 
-    def __init__(self, screen):
+    def __init__(self, screen, max_osc_length=4096):
+        assert isinstance(max_osc_length, int)
+
+        self.flags = {}
+        self.params = []  # (Used by `reset`, called from `Stream.__init__`.)
+
         super(BetterStream, self).__init__()
 
         self.handlers['square_close'] = self._square_close
         self.handlers['escape'] = self._escape
+        self.max_osc_length = max_osc_length
         self._square_close_data = []
+        self._square_close_length = 0
+        self._square_close_skip = False  # True when the payload is too long.
+        self.attach(screen)
+
+    def attach(self, screen, only=()):
+        """
+        Attach the screen. (A stream has only one screen.) This creates a
+        table that maps all event names to the bound handlers of this screen.
+        """
         self.listener = screen
 
+        events = set(['draw', 'draw_string', 'set_charset', 'square_close', 'debug'])
+        for table in (self.basic, self.escape, self.sharp, self.percent, self.csi):
+            events.update(table.values())
+
+        self._event_handlers = self._bind(events)
+
+    def _bind(self, events):
+        """
+        Return a dictionary that maps event names to the bound handlers, for
+        all the given events that are handled by the screen.
+        """
+        result = {}
+        for event in events:
+            handler = getattr(self.listener, event, None)
+            if handler is not None:
+                result[event] = handler
+        return result
+
+    def reset(self):
+        """
+        Reset state to "stream". (Only allocate a new dictionary and list when
+        they are not empty. This is called after every event.)
+        """
+        self.state = 'stream'
+        if self.flags:
+            self.flags = {}
+        if self.params:
+            self.params = []
+        self.current = ''
+
+    def feed(self, chars):
+        """
+        Consume a string. Runs of printable text (while not inside an escape
+        sequence) are passed to the screen at once, using `draw_string`. All
+        the other characters go through the state machine, one by one.
+        """
+        if not isinstance(chars, six.text_type):
+            raise TypeError('%s requires text input' % self.__class__.__name__)
+
+        match = _printable_run_re.match
+        consume = self.consume
+        length = len(chars)
+        i = 0
+
+        while i < length:
+            state = self.state
+
+            if state == 'stream':
+                m = match(chars, i)
+                if m:
+                    self.dispatch('draw_string', m.group())
+                    i = m.end()
+                    continue
+
+            elif state == 'square_close':
+                i = self._feed_square_close(chars, i)
+                continue
+
+            consume(chars[i])
+            i += 1
+
     def _escape(self, char):
         if char == ']':
             self.state = 'square_close'
@@ -44,13 +152,60 @@ class BetterStream(Stream):
             super(BetterStream, self)._escape(char)
 
     def _square_close(self, char):
-        " Parse ``Esc]<num>...BEL``sequence. "
+        """
+        Parse ``Esc]<num>...BEL`` or ``Esc]<num>...Esc\\`` sequence.
+
+        An escape character always terminates the OSC string. The backslash
+        of ST is then handled (and ignored) by the escape state.
+        """
         if char == '\07':
-            self.dispatch('square_close', ''.join(self._square_close_data))
-            self._square_close_data = []
-            self.state = "stream"
+            self._end_square_close()
+        elif char == '\x1b':
+            self._end_square_close()
+            self.state = 'escape'
         else:
-            self._square_close_data.append(char)
+            self._add_square_close_data(char)
+
+    def _feed_square_close(self, chars, i):
+        """
+        Consume the OSC string in `chars`, starting at position `i`, up to and
+        including the terminator. Return the position after it.
+        (This takes whole slices, instead of going through `_square_close`
+        for every character.)
+        """
+        m = _osc_end_re.search(chars, i)
+        end = m.start() if m else len(chars)
+
+        self._add_square_close_data(chars[i:end])
+
+        if m:
+            self._square_close(chars[end])
+            return end + 1
+        else:
+            return end
+
+    def _add_square_close_data(self, data):
+        if not self._square_close_skip:
+            self._square_close_length += len(data)
+
+            if self._square_close_length > self.max_osc_length:
+                # Too long. Discard everything until the end of the string.
+                self._square_close_skip = True
+                self._square_close_data = []
+            else:
+                self._square_close_data.append(data)
+
+    def _end_square_close(self):
+        data = ''.join(self._square_close_data)
+        skip = self._square_close_skip
+
+        self._square_close_data = []
+        self._square_close_length = 0
+        self._square_close_skip = False
+
+        if not skip:
+            self.dispatch('square_close', data)
+        self.state = 'stream'
 
     def _arguments(self, char):
         if char == '>':
@@ -64,14 +219,127 @@ class BetterStream(Stream):
         A few additions to improve performance.
 
         The code from Pyte has a few 'hasattr' calls in here, which is
-        inefficient.
+        inefficient. We use the handler table that was created in `attach`.
         """
         try:
+            handler = self._event_handlers[event]
+        except KeyError:
             handler = getattr(self.listener, event)
+
+        try:
             handler(*args, **self.flags)
         finally:
             # __after__ is used to set the correct screen height.
             self.listener.__after__(self)
 
-            if kwargs.get('reset', True):
+            if not kwargs or kwargs.get('reset', True):
                 self.reset()
+
+
+class TokenizingStream(BetterStream):
+    """
+    Alternative parser engine, with the same behaviour as `BetterStream`.
+
+    Instead of passing every character through the state machine, the input
+    is split into tokens (runs of text, CSI and escape sequences, OSC strings
+    and control characters) using one precompiled regular expression. The
+    handlers are looked up once, in tables that map the final character of a
+    sequence to the bound method of the screen.
+
+    Input that doesn't match one of the tokens (like incomplete sequences at
+    the end of a chunk) goes through the state machine of `BetterStream`.
+    """
+    def attach(self, screen, only=()):
+        super(TokenizingStream, self).attach(screen, only)
+
+        def bind(table):
+            " Map the characters in this table to the handlers. "
+            return dict((char, self._event_handlers[event]) for char, event in table.items()
+                        if event in self._event_handlers)
+
+        self._basic_handlers = bind(self.basic)
+        self._escape_handlers = bind(self.escape)
+        self._csi_handlers = bind(self.csi)
+        self._draw_string = screen.draw_string
+        self._square_close_handler = screen.square_close
+        self._after = screen.__after__
+
+    def feed(self, chars):
+        if not isinstance(chars, six.text_type):
+            raise TypeError('%s requires text input' % self.__class__.__name__)
+
+        match = _token_re.match
+        consume = self.consume
+        after = self._after
+        basic_handlers = self._basic_handlers
+        escape_handlers = self._escape_handlers
+        csi_handlers = self._csi_handlers
+
+        length = len(chars)
+        i = 0
+
+        while i < length:
+            state = self.state
+
+            if state == 'square_close':
+                i = self._feed_square_close(chars, i)
+                continue
+
+            m = match(chars, i) if state == 'stream' else None
+
+            if m:
+                kind = m.lastgroup
+                handler = None
+                args = ()
+                kwargs = {}
+
+                if kind == 'text':
+                    handler = self._draw_string
+                    args = (m.group(),)
+
+                elif kind == 'csi':
+                    handler = csi_handlers.get(m.group('csi_final'))
+                    args = [min(int(p or 0), 9999) for p in m.group('csi_params').split(';')]
+                    if '?' in m.group('csi_prefix'):
+                        kwargs = {'private': True}
+
+                elif kind == 'osc':
+                    if len(m.group('osc_data')) <= self.max_osc_length:
+                        handler = self._square_close_handler
+                        args = (m.group('osc_data'),)
+                    else:
+                        i = m.end()
+                        continue
+
+                elif kind == 'esc':
+                    handler = escape_handlers.get(m.group('esc_final'))
+
+                elif kind == 'control':
+                    handler = basic_handlers.get(m.group())
+
+                elif kind == 'ignore':
+                    i = m.end()
+                    continue
+
+                if handler:
+                    try:
+                        handler(*args, **kwargs)
+                    except (TypeError, KeyError):
+                        # Like `Stream.consume`: ignore wrong arguments and
+                        # handlers that fail because of that.
+                        pass
+                    finally:
+                        after(self)
+
+                    i = m.end()
+                    continue
+
+            consume(chars[i])
+            i += 1
+
+
+#: The available parser engines. (See the "vt-parser" option.)
+STREAM_CLASSES = {
+    'state-machine': BetterStream,
+    'tokenizer': TokenizingStream,
+}
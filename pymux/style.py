@@ -44,6 +44,7 @@ ui_style = {
     Token.PaneNumber:                   'bg:#888888',
     Token.PaneNumber.Focussed:          'bg:#aa8800',
     Token.Terminated:                   'bg:#aa0000 #ffffff',
+    Token.InputQueue:                   'bg:#aa8800 #000000',
 
     Token.ConfirmationToolbar:          'bg:#880000 #ffffff',
     Token.ConfirmationToolbar.Question: '',
@@ -76,11 +77,21 @@ class PymuxStyle(Style):
         self.pygments_style = PygmentsStyle.from_defaults(style_dict=ui_style)
         self._token_to_attrs_dict = None
 
+        # Maps ('C', ...) tokens to `Attrs`. The screens intern their tokens
+        # (see `pymux.storage`), so this only holds the styles that are
+        # actually in use.
+        self._process_attrs_cache = {}
+
     def get_attrs_for_token(self, token):
         if token and token[0] == 'C':
             # Token starts with ('C',). Token describes its own style.
-            c, fg, bg, bold, underline, italic, blink, reverse = token
-            return Attrs(fg, bg, bold, underline, italic, blink, reverse)
+            try:
+                return self._process_attrs_cache[token]
+            except KeyError:
+                c, fg, bg, bold, underline, italic, blink, reverse = token
+                attrs = self._process_attrs_cache[token] = Attrs(
+                    fg, bg, bold, underline, italic, blink, reverse)
+                return attrs
         else:
             # Take styles from Pygments style.
             return self.pygments_style.get_attrs_for_token(token)
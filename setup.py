@@ -21,7 +21,9 @@ setup(
     long_description=long_description,
     packages=find_packages('.'),
     install_requires = [
-        'prompt_toolkit==0.54',
+        # (`PaneWindow` overrides a private method of the prompt_toolkit
+        # `Window`, see tests/test_layout.py.)
+        'prompt_toolkit>=0.55,<0.58',
         'pyte',
         'six>=1.9.0',
         'docopt',
@@ -0,0 +1,23 @@
+from __future__ import unicode_literals
+
+from prompt_toolkit.layout.containers import Window
+from pymux.layout import PaneWindow
+
+import inspect
+
+
+def _get_arguments(func):
+    " The names of the arguments of this function. "
+    try:
+        return list(inspect.signature(func).parameters)
+    except AttributeError:  # Python 2.
+        return inspect.getargspec(func).args
+
+
+def test_copy_body_signature():
+    # `PaneWindow._copy_body` overrides a private method of the
+    # prompt_toolkit `Window`, that is called by `Window.write_to_screen`.
+    # When this fails, prompt_toolkit changed it, and the override is not
+    # called anymore (or called with other arguments).
+    assert _get_arguments(PaneWindow._copy_body) == _get_arguments(Window._copy_body)
+    assert '_copy_body' in inspect.getsource(Window.write_to_screen)
@@ -0,0 +1,67 @@
+from __future__ import unicode_literals
+
+from prompt_toolkit.eventloop.base import EventLoop
+from pymux.process import Process
+
+
+class _EventLoop(EventLoop):
+    """
+    Eventloop that doesn't run anything by itself. The callbacks that are
+    scheduled with `call_from_executor` are kept until `run_callbacks`.
+    """
+    def __init__(self):
+        self.readers = {}
+        self.callbacks = []
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+    def add_reader(self, fd, callback):
+        self.readers[fd] = callback
+
+    def remove_reader(self, fd):
+        self.readers.pop(fd, None)
+
+    def run_in_executor(self, callback):
+        pass
+
+    def call_from_executor(self, callback, _max_postpone_until=None):
+        self.callbacks.append(callback)
+
+    def run_callbacks(self):
+        while self.callbacks:
+            self.callbacks.pop(0)()
+
+
+def _create_process(eventloop):
+    " Process of which the child is never started. "
+    process = Process(eventloop, lambda: None, lambda: None, max_parse_time=1e-9)
+    process.pid = 1  # (Pretend that it's running.)
+    return process
+
+
+def test_suspend_stops_parsing():
+    eventloop = _EventLoop()
+    process = _create_process(eventloop)
+
+    process._pending_output = ''.join('line %i\r\n' % i for i in range(20000))
+    process._process_pending_output()
+    assert process.pending_output_size > 0
+
+    process.suspend()
+    cursor_y = process.screen.pt_screen.cursor_position.y
+    pending = process.pending_output_size
+    eventloop.run_callbacks()
+
+    assert process.screen.pt_screen.cursor_position.y == cursor_y
+    assert process.pending_output_size == pending
+
+    # After resuming, the remaining output is parsed.
+    process.resume()
+    eventloop.run_callbacks()
+
+    assert process.pending_output_size == 0
+    assert process.screen.pt_screen.cursor_position.y > cursor_y
@@ -0,0 +1,88 @@
+from __future__ import unicode_literals
+
+from pyte.streams import Stream
+from pymux.screen import BetterScreen
+from pymux.stream import BetterStream, TokenizingStream
+
+import random
+
+
+_WORDS = ['gcc', '-O2', '-Wall', 'src/main.c', 'warning:', 'unused', 'variable',
+          '[INFO]', 'Building', 'module', 'done', 'in', '0.42s', 'ok', 'über',
+          '漢字', 'tab\there']
+
+_SEQUENCES = ['\x1b[1;33m', '\x1b[0m', '\x1b[38;5;208m', '\x1b[K', '\x1b[2A',
+              '\x1b[?25l', '\x1b[?25h', '\x1b]0;make\x07', '\x1b]2;title\x1b\\',
+              '\x1bM', '\x1b[12;40H', '\x1b[3;20r', '\x1b[r', '\x1b[2P', '\x1b[4@',
+              '\x1b(0lqk\x1b(B', '\x1b[5n', '\x1b[?1h\x1b=', '\b\b', '\x1b[1;2;3A',
+              '\x1bE', '\x1b#8', '\x00\x7f', '\x1b[99999C']
+
+
+def _create_log(size):
+    """
+    Compiler/log like output, with colors, cursor movements, title changes
+    and other escape sequences.
+    """
+    r = random.Random(0)
+    lines = []
+    total = 0
+
+    while total < size:
+        line = ' '.join(r.choice(_WORDS) for _ in range(r.randint(3, 14)))
+        if r.random() < .3:
+            line = r.choice(_SEQUENCES) + line + r.choice(_SEQUENCES)
+        line += '\r\n'
+        lines.append(line)
+        total += len(line)
+
+    return ''.join(lines)
+
+
+def _feed(chunks, stream_class, feed_func):
+    " Feed the chunks to a new screen, and return its content. "
+    screen = BetterScreen(20, 80, lambda data: None)
+    stream = stream_class(screen)
+
+    for chunk in chunks:
+        feed_func(stream, chunk)
+
+    return _screen_content(screen)
+
+
+def _screen_content(screen):
+    " Comparable representation of the screen. "
+    data_buffer = screen.pt_screen.data_buffer
+    return (
+        screen.title,
+        sorted(screen.mode),
+        screen.pt_screen.show_cursor,
+        screen.pt_screen.cursor_position.x,
+        screen.pt_screen.cursor_position.y,
+        [(y, [(x, data_buffer[y][x].char, data_buffer[y][x].token)
+              for x in sorted(data_buffer[y])])
+         for y in sorted(data_buffer)])
+
+
+def test_engines_are_equivalent():
+    # The state machine of Pyte (one character at a time), `BetterStream` and
+    # `TokenizingStream` produce the same screen.
+    data = _create_log(64 * 1024)
+    chunks = [data[i:i + 4096] for i in range(0, len(data), 4096)]
+
+    expected = _feed(chunks, BetterStream, Stream.feed)
+
+    assert _feed(chunks, BetterStream, BetterStream.feed) == expected
+    assert _feed(chunks, TokenizingStream, TokenizingStream.feed) == expected
+
+
+def test_split_at_every_position():
+    # Escape sequences and text can be split across two `feed` calls at any
+    # position.
+    data = ''.join('%s %s\r\n' % (sequence, word) for sequence, word in zip(_SEQUENCES, _WORDS * 2))
+    expected = _feed([data], BetterStream, Stream.feed)
+
+    for i in range(len(data) + 1):
+        chunks = [data[:i], data[i:]]
+
+        assert _feed(chunks, BetterStream, BetterStream.feed) == expected, i
+        assert _feed(chunks, TokenizingStream, TokenizingStream.feed) == expected, i